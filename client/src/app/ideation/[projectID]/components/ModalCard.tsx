@@ -17,8 +17,11 @@ export default function ModalCard({ isOpen, onClose, title, content, type }: Mod
   const isRoadmap = type === "roadmap";
   let roadmapSteps: any[] = [];
 
-  // ✅ Safely extract JSON from roadmap content (even if there's markdown text before/after)
-  if (isRoadmap && typeof content?.roadmap === "string") {
+  // Roadmaps are saved as a parsed object; legacy docs hold the raw model text
+  if (isRoadmap && content?.roadmap && typeof content.roadmap === "object") {
+    roadmapSteps = Array.isArray(content.roadmap.steps) ? content.roadmap.steps : [];
+  } else if (isRoadmap && typeof content?.roadmap === "string") {
+    // ✅ Safely extract JSON from roadmap content (even if there's markdown text before/after)
     try {
       // find first valid JSON block using regex
       const match = content.roadmap.match(/\{[\s\S]*\}/);
@@ -1,51 +1,1931 @@
 # app.py  -- final LaunchPad AI backend (copy/paste)
 # Requirements:
 #   pip install flask firebase-admin google-generativeai flask-cors python-dotenv
+#   production: pip install "gunicorn>=23", then `gunicorn -c gunicorn.conf.py` from server/
 #
 # Environment:
-#   - firebase_credentials.json (service account) in project root
+#   - firebase_credentials.json (service account) in project root, or FIREBASE_CREDENTIALS=/path
 #   - .env with GEMINI_API_KEY and optionally FIREBASE_WEB_API_KEY (for Postman sign-in)
 #   - export GEMINI_API_KEY or use .env
+#   - optional: LLM_BACKEND=stub (+ STUB_LLM_LATENCY_MS) to run without Gemini
+#   - optional: DATA_BACKEND=memory + AUTH_BACKEND=local to run without Firebase (load tests)
+#   - optional: LLM_CACHE_DB=/path/llm_cache.sqlite3 for a persistent response cache tier
+#     (LLM_CACHE_DB_MAX_ENTRIES caps its rows, least recently used trimmed first)
+#   - optional: OUTPUT_WRITE_BEHIND_MS=250 to coalesce rapid assistant-output writes per project
+#   - optional: SERVER_TIMING=1 for per-request Server-Timing headers; METRICS_TOKEN to protect /metrics
+#   - optional: TOKEN_CHECK_REVOKED=1 to check ID-token revocation (cached for TOKEN_CACHE_MAX_AGE s)
+#   - optional: LLM_TIMEOUT_SECONDS / LLM_DEADLINE_SECONDS / LLM_MAX_RETRIES, LLM_BREAKER_THRESHOLD,
+#     LLM_RATE_PER_MINUTE (+ LLM_RATE_LIMIT_DB to share the limit across workers) for Gemini resilience
+#   - optional: GEMINI_MODEL / GEMINI_LONG_FORM_MODEL and LLM_ROUTING_FILE (JSON) for per-route model policies
+#   - optional: PREGEN_VARIANTS / PREGEN_REFRESH_SECONDS for the pre-generated motivation content pools
+#   - optional: PROMPT_TOKEN_BUDGET / CONTEXT_SUMMARY_CHARS to size project context in prompts
+#   - optional: IDEA_DEDUP_THRESHOLD (Jaccard, 0 disables) for near-duplicate idea reuse
+#   - optional: PROJECT_CACHE_MAX_ENTRIES (0 disables) / PROJECT_CACHE_MAX_MB / PROJECT_CACHE_MAX_AGE for the
+#     in-process project doc cache; PROJECT_CACHE_LISTEN=1 keeps it coherent with Firestore snapshot listeners
+#   - optional: LLM_FANOUT_WORKERS / VALIDATION_SECTION_WORKERS to override the branding batch and
+#     sectioned validation thread pool sizes
+#   - optional: ADMISSION_LLM_LIMIT / _QUEUE / _MAX_WAIT, ADMISSION_DB_LIMIT / _QUEUE / _MAX_WAIT and
+#     ADMISSION_MAX_PER_USER to size admission control (0 limit disables a class)
+#   - optional: pip install orjson brotli for faster JSON and brotli responses (JSON_SERIALIZER=stdlib to opt out);
+#     COMPRESS_MIN_BYTES (0 disables) / COMPRESS_GZIP_LEVEL / COMPRESS_BROTLI_QUALITY for response compression
 
 import json
-from flask import Flask, request, jsonify
+import click
+from flask import (
+    Blueprint, Flask, Response, current_app, g, request, jsonify, has_request_context, stream_with_context,
+    copy_current_request_context,
+)
+from flask.json.provider import DefaultJSONProvider
 from functools import wraps
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-import google.generativeai as genai
 from flask_cors import CORS
 from dotenv import load_dotenv
+import atexit
 import os
+import random
+import re
 import uuid
+import zlib
+import copy
+import gzip
+import io
+import base64
+import hashlib
+import hmac
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # ------------------- Load env and Flask Setup -------------------
+# Routes live on the `api` blueprint; create_app() (end of file) builds the Flask app.
+# firebase_admin, google.generativeai and google.api_core are imported on first use
+# (get_db, get_model, ...) -- together they are ~85% of import time, and the offline
+# backends never need them. `python bench.py startup` profiles cold imports.
 load_dotenv()
-app = Flask(__name__)
-CORS(app)  # dev: allow all; tighten in production
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+api = Blueprint("api", __name__, cli_group=None)
+
+# ------------------- Metrics -------------------
+# Timing spans (auth, Gemini, datastore calls, output writes) are aggregated into
+# per-route histograms and exported in Prometheus text format at /metrics.
+# Counters are per process; with several workers, scrape each one (or sum in Prometheus).
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# SERVER_TIMING=1 adds a Server-Timing header with the request's spans to every response.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # if set, /metrics requires "Authorization: Bearer <token>"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._counters = {}  # name -> {labels: value}
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = self._histograms[name][key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def counter(self, name, labels=None):
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted((labels or {}).items())), 0)
+
+    @staticmethod
+    def _labels(pairs):
+        return ",".join(f'{k}="{str(v)}"'.replace("\n", " ") for k, v in pairs)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                kind, text = self._help.get(name, ("counter", name))
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{{{self._labels(key)}}} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {self._help.get(name, ('', name))[1]}", f"# TYPE {name} histogram"]
+                for key, counts in sorted(series.items()):
+                    for bound, count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{{{self._labels(key + (('le', bound),))}}} {count}")
+                    lines.append(f"{name}_bucket{{{self._labels(key + (('le', '+Inf'),))}}} {counts[-1]}")
+                    lines.append(f"{name}_sum{{{self._labels(key)}}} {counts[-2]}")
+                    lines.append(f"{name}_count{{{self._labels(key)}}} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(LATENCY_BUCKETS)
+metrics.describe("lpai_request_seconds", "histogram", "Request latency by route.")
+metrics.describe("lpai_span_seconds", "histogram", "Time spent in instrumented spans, by route and span.")
+metrics.describe("lpai_llm_calls_total", "counter", "Gemini calls by model and outcome.")
+metrics.describe("lpai_llm_prompt_chars_total", "counter", "Prompt characters sent to Gemini.")
+metrics.describe("lpai_llm_response_chars_total", "counter", "Response characters received from Gemini.")
+metrics.describe("lpai_llm_prompt_tokens_total", "counter", "Prompt tokens reported by Gemini usage metadata.")
+metrics.describe("lpai_llm_output_tokens_total", "counter", "Output tokens reported by Gemini usage metadata.")
+
+
+def _endpoint_name():
+    # endpoints are "api.<view>"; labels and routing policies use the view name
+    return (request.endpoint or "unknown").rpartition(".")[2]
+
+
+def _current_route():
+    return _endpoint_name() if has_request_context() else "background"
+
+
+def _record_span(name, elapsed):
+    metrics.observe("lpai_span_seconds", {"route": _current_route(), "span": name}, elapsed)
+    if has_request_context():
+        g.setdefault("spans", []).append((name, elapsed))
+
+
+@contextmanager
+def span(name):
+    """Time a block as `name`; aggregated under the current route."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_span(name, time.perf_counter() - start)
+
+
+class InstrumentedStore:
+    """Wraps a user/project store so every method call is timed as a `<prefix>.<method>` span."""
+
+    def __init__(self, store, prefix):
+        self._store = store
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def timed(*args, **kwargs):
+            with span(f"{self._prefix}.{name}"):
+                return attr(*args, **kwargs)
+        return timed
+
+
+@api.before_app_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@api.after_app_request
+def _record_request_metrics(resp):
+    start = g.get("request_start")
+    if start is None:
+        return resp
+    elapsed = time.perf_counter() - start
+    metrics.observe("lpai_request_seconds",
+                    {"route": _endpoint_name(), "method": request.method, "status": resp.status_code},
+                    elapsed)
+    if SERVER_TIMING:
+        totals = {}
+        for name, spent in g.get("spans", []):
+            totals[name] = totals.get(name, 0.0) + spent
+        entries = [f"{name};dur={spent * 1000:.2f}" for name, spent in totals.items()]
+        entries.append(f"total;dur={elapsed * 1000:.2f}")
+        resp.headers["Server-Timing"] = ", ".join(entries)
+    return resp
 
 # ------------------- Firebase Setup -------------------
-cred = credentials.Certificate("firebase_credentials.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# DATA_BACKEND=memory keeps users/projects in process memory instead of Firestore, so the
+# server can be load tested offline (pair with LLM_BACKEND=stub and AUTH_BACKEND=local).
+DATA_BACKEND = os.getenv("DATA_BACKEND", "firestore")
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "firebase_credentials.json")
+_firebase_lock = threading.Lock()
+_db = None
+
+
+def get_firebase_app():
+    """Initialize firebase_admin from FIREBASE_CREDENTIALS on first use."""
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS))
+
+
+def get_db():
+    """The shared Firestore client, created on first use."""
+    global _db
+    if _db is None:
+        from firebase_admin import firestore
+
+        firebase_app = get_firebase_app()
+        with _firebase_lock:
+            if _db is None:
+                _db = firestore.client(firebase_app)
+    return _db
+
+
+def firebase_auth():
+    """firebase_admin.auth, with the Firebase app initialized."""
+    from firebase_admin import auth
+
+    get_firebase_app()
+    return auth
+
+
+def _firestore():
+    from firebase_admin import firestore
+    return firestore
+
+
+def _api_exceptions():
+    # evaluated only when an `except` clause is reached, i.e. after the client raised
+    from google.api_core import exceptions
+    return exceptions
+
+# ------------------- Data Access Layer -------------------
+class NotFoundError(ValueError):
+    """A user/project targeted by a write does not exist; rendered as a 404."""
+
+# Routes reach the datastore only through user_store / project_store.
+# Missing users/projects on writes surface as NotFoundError("... not found").
+# Saved outputs and whiteboard notes live in subcollections of the project doc
+# (projects/<id>/savedOutputs/<auto id>, projects/<id>/notes/<noteID>) rather than in one
+# ever-growing array, so edits are single-doc writes and projects stay far below the
+# 1 MiB document limit. Every subcollection doc carries its projectID.
+SAVED_OUTPUTS = "savedOutputs"
+NOTES = "notes"
+CONTEXT_SUMMARY = "contextSummary"  # project field: compact text of each lastOutputs entry, for prompts
+PROJECT_BATCH_SIZE = 100  # document refs per get_all call
+
+
+class FirestoreUserStore:
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def _users(self):
+        return (self._db or get_db()).collection("users")
+
+    def create_account(self, email, password, name):
+        """Create the Firebase Auth user and its profile doc; returns the uid."""
+        user = firebase_auth().create_user(email=email, password=password, display_name=name)
+        self._users.document(user.uid).set({
+            "userID": user.uid,
+            "name": name,
+            "email": email,
+            "projects": []
+        })
+        return user.uid
+
+    def get(self, uid):
+        doc = self._users.document(uid).get()
+        return doc.to_dict() if doc.exists else None
+
+    def add_project(self, uid, projectID):
+        self._update(uid, {"projects": _firestore().ArrayUnion([projectID])})
+
+    def add_projects(self, uid, project_ids):
+        self._update(uid, {"projects": _firestore().ArrayUnion(list(project_ids))})
+
+    def remove_project(self, uid, projectID):
+        self._update(uid, {"projects": _firestore().ArrayRemove([projectID])})
+
+    def _update(self, uid, fields):
+        try:
+            self._users.document(uid).update(fields)
+        except _api_exceptions().NotFound:
+            raise NotFoundError("User not found")
+
+
+class FirestoreProjectStore:
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    @property
+    def _projects(self):
+        return self.db.collection("projects")
+
+    def _ref(self, projectID):
+        return self._projects.document(projectID)
+
+    def create(self, fields):
+        ref = self._projects.document()
+        ref.set(dict(fields, projectID=ref.id))
+        return ref.id
+
+    def get(self, projectID, fields=None):
+        """Project doc as a dict (only `fields` if given), or None if missing."""
+        doc = self._ref(projectID).get(field_paths=fields)
+        return doc.to_dict() if doc.exists else None
+
+    def exists(self, projectID):
+        return self.get(projectID, ["projectID"]) is not None
+
+    def get_many(self, project_ids, fields=None):
+        """
+        Fetch many project docs with batched get_all calls (one round trip per
+        PROJECT_BATCH_SIZE ids). Returns {projectID: dict} for the docs that exist.
+        """
+        found = {}
+        for i in range(0, len(project_ids), PROJECT_BATCH_SIZE):
+            refs = [self._ref(pid) for pid in project_ids[i:i + PROJECT_BATCH_SIZE]]
+            for snap in self.db.get_all(refs, field_paths=fields):
+                if snap.exists:
+                    found[snap.id] = snap.to_dict()
+        return found
+
+    def watch(self, projectID, on_change):
+        """
+        Call on_change() from a listener thread whenever the doc changes after this call
+        (the listener's initial snapshot is skipped). Returns an unsubscribe function.
+        """
+        initial = [True]
+
+        def on_snapshot(snapshots, changes, read_time):
+            if initial[0]:
+                initial[0] = False
+            else:
+                on_change()
+        return self._ref(projectID).on_snapshot(on_snapshot).unsubscribe
+
+    def update(self, projectID, fields):
+        """Update top-level or dotted-path fields."""
+        try:
+            self._ref(projectID).update(fields)
+        except _api_exceptions().NotFound:
+            raise NotFoundError("Project not found")
+
+    def append(self, projectID, field, items):
+        """Add items to an array field (ArrayUnion semantics)."""
+        self.update(projectID, {field: _firestore().ArrayUnion(items)})
+
+    def delete(self, projectID):
+        # Firestore does not cascade deletes to subcollections
+        ref = self._ref(projectID)
+        for group in (SAVED_OUTPUTS, NOTES):
+            while True:
+                snaps = list(ref.collection(group).limit(500).stream())
+                if not snaps:
+                    break
+                batch = self.db.batch()
+                for snap in snaps:
+                    batch.delete(snap.reference)
+                batch.commit()
+        ref.delete()
+
+    def add_saved_output(self, projectID, doc):
+        self._ref(projectID).collection(SAVED_OUTPUTS).add(doc)
+
+    def import_projects(self, projects, batch_size=500):
+        """
+        Create projects from (fields, saved output docs, note docs) tuples with batched
+        writes of at most batch_size operations; returns the new projectIDs in order.
+        Items are stamped with their new projectID. A project with more items than one
+        batch holds spans consecutive batches.
+        """
+        project_ids = []
+        batch, ops = self.db.batch(), 0
+        for fields, saved_docs, notes in projects:
+            ref = self._projects.document()
+            project_ids.append(ref.id)
+            writes = [(ref, dict(fields, projectID=ref.id))]
+            writes += [(ref.collection(SAVED_OUTPUTS).document(), dict(d, projectID=ref.id)) for d in saved_docs]
+            writes += [(ref.collection(NOTES).document(n["noteID"]), dict(n, projectID=ref.id)) for n in notes]
+            for doc_ref, doc in writes:
+                batch.set(doc_ref, doc)
+                ops += 1
+                if ops == batch_size:
+                    batch.commit()
+                    batch, ops = self.db.batch(), 0
+        if ops:
+            batch.commit()
+        return project_ids
+
+    def record_outputs(self, projectID, last_outputs, saved_docs, summaries=None):
+        """
+        Set lastOutputs.<category> (and contextSummary.<category> for each item of summaries)
+        and add saved_docs, in one batch.
+        """
+        ref = self._ref(projectID)
+        batch = self.db.batch()
+        fields = {f"lastOutputs.{c}": output for c, output in last_outputs.items()}
+        fields.update({f"{CONTEXT_SUMMARY}.{c}": summary for c, summary in (summaries or {}).items()})
+        # update() fails if the doc is missing, so no separate existence read
+        batch.update(ref, fields)
+        for doc in saved_docs:
+            batch.set(ref.collection(SAVED_OUTPUTS).document(), doc)
+        try:
+            batch.commit()
+        except _api_exceptions().NotFound:
+            raise NotFoundError("Project not found")
+
+    def saved_items(self, projectID):
+        """Raw saved-output and note docs of one project, unordered."""
+        ref = self._ref(projectID)
+        return [snap.to_dict() for group in (SAVED_OUTPUTS, NOTES) for snap in ref.collection(group).stream()]
+
+    def saved_items_many(self, project_ids):
+        """
+        saved_items for many projects using chunked collection-group `in` queries
+        (Firestore allows 30 values per `in`). Needs the single-field collection-group
+        index on projectID for both subcollections.
+        """
+        docs = {pid: [] for pid in project_ids}
+        for group in (SAVED_OUTPUTS, NOTES):
+            for i in range(0, len(project_ids), 30):
+                query = self.db.collection_group(group).where("projectID", "in", project_ids[i:i + 30])
+                for snap in query.stream():
+                    d = snap.to_dict()
+                    docs.setdefault(d.get("projectID"), []).append(d)
+        return docs
+
+    def add_note(self, projectID, note):
+        self._ref(projectID).collection(NOTES).document(note["noteID"]).set(dict(note, projectID=projectID))
+
+    def update_note(self, projectID, noteID, fields):
+        """Returns False if the note has no doc (e.g. it is still in a legacy array)."""
+        try:
+            self._ref(projectID).collection(NOTES).document(noteID).update(fields)
+            return True
+        except _api_exceptions().NotFound:
+            return False
+
+    def delete_note(self, projectID, noteID):
+        """Returns False if the note has no doc (e.g. it is still in a legacy array)."""
+        note_ref = self._ref(projectID).collection(NOTES).document(noteID)
+        if not note_ref.get(field_paths=["noteID"]).exists:
+            return False
+        note_ref.delete()
+        return True
+
+    def migrate_legacy_saved_outputs(self, project_ids=None, dry_run=False):
+        """
+        Move legacy savedOutputs arrays into the subcollections; yields (projectID, items moved).
+        Doc IDs are deterministic, so re-running after a partial failure is safe; the
+        array is removed in each project's last batch.
+        """
+        if project_ids:
+            snaps = [self._ref(pid).get() for pid in project_ids]
+        else:
+            snaps = self._projects.stream()
+        for snap in snaps:
+            if not snap.exists:
+                continue
+            writes = _legacy_saved_output_docs(snap.id, (snap.to_dict() or {}).get("savedOutputs"))
+            if not dry_run and writes:
+                for i in range(0, len(writes), 499):
+                    batch = self.db.batch()
+                    for group, doc_id, doc in writes[i:i + 499]:
+                        batch.set(snap.reference.collection(group).document(doc_id), doc)
+                    if i + 499 >= len(writes):
+                        batch.update(snap.reference, {"savedOutputs": _firestore().DELETE_FIELD})
+                    batch.commit()
+            yield snap.id, len(writes)
+
+    def backfill_context_summaries(self, project_ids=None, dry_run=False):
+        """Summarize every lastOutputs entry into contextSummary; yields (projectID, categories)."""
+        if project_ids:
+            snaps = [self._ref(pid).get() for pid in project_ids]
+        else:
+            snaps = self._projects.select(["lastOutputs"]).stream()
+        for snap in snaps:
+            if not snap.exists:
+                continue
+            last_outputs = (snap.to_dict() or {}).get("lastOutputs") or {}
+            if not dry_run and last_outputs:
+                snap.reference.update({f"{CONTEXT_SUMMARY}.{c}": summarize_output(o) for c, o in last_outputs.items()})
+            yield snap.id, len(last_outputs)
+
+
+def _legacy_saved_output_docs(projectID, legacy):
+    """(subcollection, doc id, doc) for each item of a legacy savedOutputs array."""
+    if not isinstance(legacy, list):
+        return []
+    writes = []
+    last_ts = ""
+    for i, item in enumerate(legacy):
+        if not isinstance(item, dict):
+            item = {"type": "unknown", "content": item}
+        doc = dict(item, projectID=projectID, legacyIndex=i)
+        if item.get("noteID"):
+            # legacy notes carry no timestamp; order them after the output saved before them
+            doc.setdefault("createdAt", last_ts)
+            writes.append((NOTES, item["noteID"], doc))
+        else:
+            doc.setdefault("savedAt", last_ts)
+            writes.append((SAVED_OUTPUTS, f"legacy-{i:05d}", doc))
+        last_ts = doc.get("savedAt") or doc.get("createdAt") or last_ts
+    return writes
+
+
+# Simulated round-trip time for every memory-store call, so load tests can model Firestore latency.
+STUB_DB_LATENCY_MS = float(os.getenv("STUB_DB_LATENCY_MS", "0"))
+
+
+def _simulate_db_latency():
+    if STUB_DB_LATENCY_MS:
+        time.sleep(STUB_DB_LATENCY_MS / 1000.0)
+
+
+def _set_path(d, path, value):
+    """Apply a Firestore-style dotted-path update to a plain dict."""
+    *parents, leaf = path.split(".")
+    for key in parents:
+        d = d.setdefault(key, {})
+    d[leaf] = value
+
+
+class MemoryUserStore:
+    """Process-local UserStore for offline load tests; values are copied in and out."""
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def create_account(self, email, password, name):
+        _simulate_db_latency()
+        uid = uuid.uuid4().hex
+        with self._lock:
+            self._users[uid] = {"userID": uid, "name": name, "email": email, "projects": []}
+        return uid
+
+    def get(self, uid):
+        _simulate_db_latency()
+        with self._lock:
+            user = self._users.get(uid)
+            return copy.deepcopy(user) if user is not None else None
+
+    def add_project(self, uid, projectID):
+        _simulate_db_latency()
+        with self._lock:
+            projects = self._user(uid)["projects"]
+            if projectID not in projects:
+                projects.append(projectID)
+
+    def add_projects(self, uid, project_ids):
+        _simulate_db_latency()
+        with self._lock:
+            projects = self._user(uid)["projects"]
+            projects.extend(pid for pid in project_ids if pid not in projects)
+
+    def remove_project(self, uid, projectID):
+        _simulate_db_latency()
+        with self._lock:
+            user = self._user(uid)
+            user["projects"] = [p for p in user["projects"] if p != projectID]
+
+    def _user(self, uid):
+        if uid not in self._users:
+            raise NotFoundError("User not found")
+        return self._users[uid]
+
+
+class MemoryProjectStore:
+    """Process-local ProjectStore for offline load tests; values are copied in and out."""
+
+    def __init__(self):
+        self._projects = {}
+        self._saved = {}  # projectID -> [saved output docs]
+        self._notes = {}  # projectID -> {noteID: note doc}
+        self._lock = threading.Lock()
+
+    def _project(self, projectID):
+        if projectID not in self._projects:
+            raise NotFoundError("Project not found")
+        return self._projects[projectID]
+
+    def create(self, fields):
+        _simulate_db_latency()
+        projectID = uuid.uuid4().hex[:20]
+        with self._lock:
+            self._projects[projectID] = copy.deepcopy(dict(fields, projectID=projectID))
+            self._saved[projectID] = []
+            self._notes[projectID] = {}
+        return projectID
+
+    def get(self, projectID, fields=None):
+        _simulate_db_latency()
+        with self._lock:
+            project = self._projects.get(projectID)
+            if project is None:
+                return None
+            if fields is not None:
+                project = {f: project[f] for f in fields if f in project}
+            return copy.deepcopy(project)
+
+    def exists(self, projectID):
+        _simulate_db_latency()
+        with self._lock:
+            return projectID in self._projects
+
+    def get_many(self, project_ids, fields=None):
+        _simulate_db_latency()
+        found = {}
+        with self._lock:
+            for pid in project_ids:
+                project = self._projects.get(pid)
+                if project is not None:
+                    if fields is not None:
+                        project = {f: project[f] for f in fields if f in project}
+                    found[pid] = copy.deepcopy(project)
+        return found
+
+    def update(self, projectID, fields):
+        _simulate_db_latency()
+        with self._lock:
+            project = self._project(projectID)
+            for path, value in fields.items():
+                _set_path(project, path, copy.deepcopy(value))
+
+    def append(self, projectID, field, items):
+        _simulate_db_latency()
+        with self._lock:
+            values = self._project(projectID).setdefault(field, [])
+            values.extend(copy.deepcopy(item) for item in items if item not in values)
+
+    def delete(self, projectID):
+        _simulate_db_latency()
+        with self._lock:
+            self._projects.pop(projectID, None)
+            self._saved.pop(projectID, None)
+            self._notes.pop(projectID, None)
+
+    def add_saved_output(self, projectID, doc):
+        _simulate_db_latency()
+        with self._lock:
+            self._saved.setdefault(projectID, []).append(copy.deepcopy(doc))
+
+    def import_projects(self, projects, batch_size=500):
+        ops = sum(1 + len(saved_docs) + len(notes) for _, saved_docs, notes in projects)
+        for _ in range(max(1, -(-ops // batch_size))):  # one round trip per batch
+            _simulate_db_latency()
+        project_ids = []
+        with self._lock:
+            for fields, saved_docs, notes in projects:
+                projectID = uuid.uuid4().hex[:20]
+                project_ids.append(projectID)
+                self._projects[projectID] = copy.deepcopy(dict(fields, projectID=projectID))
+                self._saved[projectID] = [copy.deepcopy(dict(d, projectID=projectID)) for d in saved_docs]
+                self._notes[projectID] = {n["noteID"]: copy.deepcopy(dict(n, projectID=projectID)) for n in notes}
+        return project_ids
+
+    def record_outputs(self, projectID, last_outputs, saved_docs, summaries=None):
+        _simulate_db_latency()
+        with self._lock:
+            project = self._project(projectID)
+            for category, output in last_outputs.items():
+                _set_path(project, f"lastOutputs.{category}", copy.deepcopy(output))
+            for category, summary in (summaries or {}).items():
+                _set_path(project, f"{CONTEXT_SUMMARY}.{category}", summary)
+            self._saved[projectID].extend(copy.deepcopy(saved_docs))
+
+    def saved_items(self, projectID):
+        _simulate_db_latency()
+        with self._lock:
+            return self._saved_items(projectID)
+
+    def saved_items_many(self, project_ids):
+        _simulate_db_latency()
+        with self._lock:
+            return {pid: self._saved_items(pid) for pid in project_ids}
+
+    def _saved_items(self, projectID):
+        return copy.deepcopy(self._saved.get(projectID, []) + list(self._notes.get(projectID, {}).values()))
+
+    def add_note(self, projectID, note):
+        _simulate_db_latency()
+        with self._lock:
+            self._notes.setdefault(projectID, {})[note["noteID"]] = copy.deepcopy(dict(note, projectID=projectID))
+
+    def update_note(self, projectID, noteID, fields):
+        _simulate_db_latency()
+        with self._lock:
+            note = self._notes.get(projectID, {}).get(noteID)
+            if note is None:
+                return False
+            note.update(copy.deepcopy(fields))
+            return True
+
+    def delete_note(self, projectID, noteID):
+        _simulate_db_latency()
+        with self._lock:
+            return self._notes.get(projectID, {}).pop(noteID, None) is not None
+
+
+
+# ------------------- Project Cache -------------------
+# Hot project docs are served from process memory instead of one datastore read per
+# request. Writes made through project_store patch or drop the cached doc, so a worker
+# always reads its own writes; writes by other workers/hosts show up after at most
+# PROJECT_CACHE_MAX_AGE seconds, or as soon as Firestore reports them with
+# PROJECT_CACHE_LISTEN=1 (one snapshot listener per cached doc, removed with the entry).
+# Memory is bounded by entry count and by the docs' estimated JSON size.
+PROJECT_CACHE_MAX_ENTRIES = int(os.getenv("PROJECT_CACHE_MAX_ENTRIES", "1000"))  # 0 disables the cache
+PROJECT_CACHE_MAX_MB = float(os.getenv("PROJECT_CACHE_MAX_MB", "64"))
+PROJECT_CACHE_MAX_AGE = float(os.getenv("PROJECT_CACHE_MAX_AGE", "30"))
+PROJECT_CACHE_LISTEN = os.getenv("PROJECT_CACHE_LISTEN", "").lower() in ("1", "true", "yes")
+metrics.describe("lpai_project_cache_lookups_total", "counter", "Project doc lookups by route and result (hit/miss).")
+
+
+class CachedProjectStore:
+    """
+    Read-through cache of project docs in front of a ProjectStore. A miss reads only the
+    fields the caller asked for and caches that projection; a projection (or a whole doc,
+    read without fields) answers later reads of the same or fewer fields. All views of a
+    project share one entry, expiry and invalidation. Methods that only touch the
+    savedOutputs/notes subcollections pass straight through.
+    """
+
+    def __init__(self, store, max_entries, max_bytes, max_age, listen=False):
+        self._store = store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.listen = listen and hasattr(store, "watch")
+        self._entries = OrderedDict()  # projectID -> ({view key: (doc, size)}, size, expires_at)
+        self._watches = {}  # projectID -> unsubscribe()
+        self._loading = {}  # projectID -> token of the newest in-flight miss; popped by writes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "expirations": 0}
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    # --- reads ---
+    def get(self, projectID, fields=None):
+        doc = self._cached(projectID, fields)
+        if doc is None:
+            token = self._begin_load(projectID)
+            doc = self._store.get(projectID, fields)
+            self._end_load(projectID, token, doc, fields)
+            if doc is None:
+                return None
+        return self._project(doc, fields)
+
+    def exists(self, projectID):
+        # any cached view answers for free; a miss is not worth loading a doc for
+        return self._cached(projectID, ()) is not None or self._store.exists(projectID)
+
+    def get_many(self, project_ids, fields=None):
+        found, missing = {}, []
+        for pid in project_ids:
+            doc = self._cached(pid, fields)
+            if doc is None:
+                missing.append(pid)
+            else:
+                found[pid] = self._project(doc, fields)
+        if missing:
+            tokens = {pid: self._begin_load(pid) for pid in missing}
+            loaded = self._store.get_many(missing, fields)
+            for pid in missing:
+                self._end_load(pid, tokens[pid], loaded.get(pid), fields)
+                if pid in loaded:
+                    found[pid] = self._project(loaded[pid], fields)
+        return found
+
+    @staticmethod
+    def _view_key(fields):
+        return None if fields is None else tuple(sorted(set(fields)))
+
+    @staticmethod
+    def _project(doc, fields):
+        if fields is not None:
+            doc = {f: doc[f] for f in fields if f in doc}
+        return copy.deepcopy(doc)
+
+    # --- writes ---
+    def update(self, projectID, fields):
+        self._store.update(projectID, fields)
+        self.invalidate(projectID)
+
+    def append(self, projectID, field, items):
+        self._store.append(projectID, field, items)
+        self.invalidate(projectID)
+
+    def delete(self, projectID):
+        self._store.delete(projectID)
+        self.invalidate(projectID)
+
+    def record_outputs(self, projectID, last_outputs, saved_docs, summaries=None):
+        self._store.record_outputs(projectID, last_outputs, saved_docs, summaries)
+        # write-through: the doc read right after an assistant call (trackProgress, the
+        # next prompt's context) stays a hit
+        fields = {f"lastOutputs.{c}": output for c, output in last_outputs.items()}
+        fields.update({f"{CONTEXT_SUMMARY}.{c}": summary for c, summary in (summaries or {}).items()})
+        with self._lock:
+            self._loading.pop(projectID, None)
+            entry = self._entries.get(projectID)
+            if entry is None:
+                return
+            views = {}
+            for key, (doc, _) in entry[0].items():
+                doc = copy.deepcopy(doc)
+                for path, value in fields.items():
+                    if key is None or path.split(".", 1)[0] in key:
+                        _set_path(doc, path, copy.deepcopy(value))
+                views[key] = doc
+            stale = self._put(projectID, views, entry[2])
+        self._unwatch(stale)
+
+    def migrate_legacy_saved_outputs(self, project_ids=None, dry_run=False):
+        for projectID, moved in self._store.migrate_legacy_saved_outputs(project_ids, dry_run):
+            self.invalidate(projectID)
+            yield projectID, moved
+
+    def backfill_context_summaries(self, project_ids=None, dry_run=False):
+        for projectID, categories in self._store.backfill_context_summaries(project_ids, dry_run):
+            self.invalidate(projectID)
+            yield projectID, categories
+
+    # --- cache bookkeeping ---
+    def invalidate(self, projectID):
+        with self._lock:
+            self._loading.pop(projectID, None)
+            stale = self._drop(projectID)
+            if stale:
+                self.counters["invalidations"] += 1
+        self._unwatch(stale)
+
+    def _cached(self, projectID, fields):
+        """A cached view holding at least `fields` (all fields if None), or None."""
+        stale = []
+        doc = None
+        with self._lock:
+            entry = self._entries.get(projectID)
+            if entry is not None and entry[2] <= time.time():
+                stale = self._drop(projectID)
+                self.counters["expirations"] += 1
+                entry = None
+            if entry is not None:
+                wanted = self._view_key(fields)
+                for key, (view, _) in entry[0].items():
+                    if key is None or (wanted is not None and set(wanted) <= set(key)):
+                        doc = view
+                        break
+            hit = doc is not None
+            self.counters["hits" if hit else "misses"] += 1
+            if hit:
+                self._entries.move_to_end(projectID)
+        self._unwatch(stale)
+        metrics.inc("lpai_project_cache_lookups_total", {"route": _current_route(), "result": "hit" if hit else "miss"})
+        return doc
+
+    def _begin_load(self, projectID):
+        token = object()
+        with self._lock:
+            self._loading[projectID] = token
+        return token
+
+    def _end_load(self, projectID, token, doc, fields):
+        """Cache a freshly read doc or projection, unless a write landed while it was being read."""
+        with self._lock:
+            if self._loading.get(projectID) is not token:
+                return
+            del self._loading[projectID]
+            if doc is None:
+                return
+            key = self._view_key(fields)
+            entry = self._entries.get(projectID)
+            if entry is None or key is None:
+                # a whole doc supersedes the projections
+                views, expires_at = {}, time.time() + self.max_age
+            else:
+                # the entry keeps its expiry, so no view outlives the staleness bound
+                views, expires_at = {k: v for k, (v, _) in entry[0].items() if k != key}, entry[2]
+            views[key] = copy.deepcopy(doc)
+            stale = self._put(projectID, views, expires_at)
+            watch = self.listen and projectID in self._entries and projectID not in self._watches
+            if watch:
+                reservation = self._watches[projectID] = object()  # filled in below, outside the lock
+        self._unwatch(stale)
+        if watch:
+            try:
+                unsubscribe = self._store.watch(projectID, lambda: self.invalidate(projectID))
+            except Exception as e:
+                print("Project listener failed:", projectID, e)
+                unsubscribe = None
+            with self._lock:
+                if self._watches.get(projectID) is reservation:
+                    self._watches[projectID] = unsubscribe
+                    unsubscribe = None
+            self._unwatch([unsubscribe])
+
+    def _put(self, projectID, views, expires_at):
+        """Store a project's views (lock held); returns the unsubscribe functions of evicted entries."""
+        views = {key: (doc, len(json.dumps(doc, default=str))) for key, doc in views.items()}
+        size = sum(view_size for _, view_size in views.values())
+        if size > self.max_bytes:
+            return self._drop(projectID)
+        old = self._entries.pop(projectID, None)  # a refreshed doc keeps its listener
+        self._bytes += size - (old[1] if old else 0)
+        self._entries[projectID] = (views, size, expires_at)
+        stale = []
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            stale += self._drop(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+        return stale
+
+    def _drop(self, projectID):
+        """Remove one entry (lock held); returns its listener's unsubscribe, if any, in a list."""
+        entry = self._entries.pop(projectID, None)
+        if entry is None:
+            return []
+        self._bytes -= entry[1]
+        return [self._watches.pop(projectID, None)]
+
+    @staticmethod
+    def _unwatch(unsubscribes):
+        unsubscribes = [u for u in unsubscribes if callable(u)]
+        if unsubscribes:
+            # off-thread: the invalidation may be running on the listener's own thread
+            threading.Thread(target=_unsubscribe_all, args=(unsubscribes,), daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries), bytes=self._bytes,
+                         listeners=sum(1 for w in self._watches.values() if callable(w)))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hitRatio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+def _unsubscribe_all(unsubscribes):
+    for unsubscribe in unsubscribes:
+        try:
+            unsubscribe()
+        except Exception as e:
+            print("Project listener unsubscribe failed:", e)
+
+if DATA_BACKEND == "firestore":
+    user_store = FirestoreUserStore()  # the client is created by get_db() on first use
+    project_store = FirestoreProjectStore()
+else:
+    user_store = MemoryUserStore()
+    project_store = MemoryProjectStore()
+# bulk export/import bypass the project cache, so a full scan does not evict the hot docs
+bulk_project_store = InstrumentedStore(project_store, "project_store")
+project_cache = None
+if PROJECT_CACHE_MAX_ENTRIES > 0:
+    project_store = project_cache = CachedProjectStore(project_store, PROJECT_CACHE_MAX_ENTRIES, int(PROJECT_CACHE_MAX_MB * 1024 * 1024),
+                                       PROJECT_CACHE_MAX_AGE, PROJECT_CACHE_LISTEN)
+user_store = InstrumentedStore(user_store, "user_store")
+project_store = InstrumentedStore(project_store, "project_store")
 
 # ------------------- Gemini / Google GenAI Setup -------------------
+# LLM_BACKEND=stub swaps Gemini for a local canned-response model (benchmarks, offline dev).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "0"))
+
 # You set GEMINI_API_KEY in .env as GEMINI_API_KEY="..."
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise RuntimeError("GEMINI_API_KEY env var not set. Put it in .env or export it.")
+_genai = None
+
+
+def get_genai():
+    """
+    google.generativeai, imported and configured on first use (checked for the API key then).
+    The SDK keeps one underlying client (and its gRPC channel / HTTP session) per process,
+    so every model handle shares the same connection pool.
+    """
+    global _genai
+    if _genai is None:
+        if not GEMINI_API_KEY:
+            raise RuntimeError("GEMINI_API_KEY env var not set. Put it in .env or export it.")
+        import google.generativeai as genai
+
+        genai.configure(api_key=GEMINI_API_KEY, transport=os.getenv("GEMINI_TRANSPORT", "grpc"))
+        _genai = genai
+    return _genai
+
+
+class _StubUsage:
+    def __init__(self, prompt_text, text):
+        # rough chars-per-token estimate, good enough for load-test accounting
+        self.prompt_token_count = len(prompt_text) // 4
+        self.candidates_token_count = len(text) // 4
+
+
+class _StubResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class StubModel:
+    """Offline stand-in for genai.GenerativeModel; sleeps STUB_LLM_LATENCY_MS per call."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt_text, stream=False, generation_config=None, **kwargs):
+        time.sleep(STUB_LLM_LATENCY_MS / 1000.0)
+        text = f"[stub:{self.model_name}] response to a {len(prompt_text)}-char prompt"
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            text = json.dumps({"steps": [
+                {"name": "Stub discovery", "description": text, "timeframe": "Weeks 1-4"},
+                {"name": "Stub launch", "description": text, "timeframe": "Weeks 5-8"},
+            ]})
+        usage = _StubUsage(prompt_text, text)
+        if stream:
+            words = text.split()
+            return [_StubResponse(word + " ", usage if i == len(words) - 1 else None) for i, word in enumerate(words)]
+        return _StubResponse(text, usage)
+
+
+# One model handle per model name, built lazily on first use and shared by all request threads.
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name):
+    """Return the shared model handle for model_name, creating it on first use."""
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = StubModel(model_name) if LLM_BACKEND == "stub" else get_genai().GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
+
+# ------------------- Gemini Resilience -------------------
+# Every Gemini call gets a per-attempt timeout and an overall deadline, retries 429/5xx
+# with jittered exponential backoff (honouring the server's retry delay), fast-fails
+# through a per-model circuit breaker while the upstream is degraded, and waits on a
+# token bucket so the process (or, with LLM_RATE_LIMIT_DB, every worker on the host)
+# stays under quota.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))  # per attempt
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))  # all attempts, backoff and queueing
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))  # consecutive failures to open
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "0"))  # 0 disables the limiter
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "10"))
+LLM_RATE_LIMIT_DB = os.getenv("LLM_RATE_LIMIT_DB")  # SQLite path shared by all workers on one host
+_retryable = None
+
+
+def _retryable_llm_errors():
+    """Exceptions worth retrying: 429/5xx/timeouts from google.api_core, and network errors."""
+    global _retryable
+    if _retryable is None:
+        e = _api_exceptions()
+        _retryable = (
+            e.ResourceExhausted, e.TooManyRequests, e.ServiceUnavailable, e.InternalServerError,
+            e.DeadlineExceeded, TimeoutError, ConnectionError,
+        )
+    return _retryable
+
+metrics.describe("lpai_llm_retries_total", "counter", "Gemini attempts retried after a 429/5xx/timeout.")
+metrics.describe("lpai_llm_breaker_trips_total", "counter", "Times a model's circuit breaker opened.")
+metrics.describe("lpai_llm_rejected_total", "counter", "Gemini calls rejected locally (breaker open, rate limit, deadline).")
+
+
+class LLMError(Exception):
+    """Gemini failed; rendered as a JSON error with `status` (and Retry-After when known)."""
+
+    def __init__(self, message, status=502, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMUnavailableError(LLMError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message, status=503, retry_after=retry_after)
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open (one probe) after `cooldown`."""
+
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    raise LLMUnavailableError(f"{self.name} circuit open", retry_after=remaining)
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    raise LLMUnavailableError(f"{self.name} circuit half-open, probe in flight", retry_after=1)
+                self._probing = True
+
+    def cancel_call(self):
+        """The call admitted by before_call() never reached the model; free the probe slot."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    metrics.inc("lpai_llm_breaker_trips_total", {"model": self.name})
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """In-process token bucket: `rate` tokens per second, up to `burst` banked."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in SQLite, so every worker process on the host shares it.
+    If the database can't be used (e.g. locked past the busy timeout) the call falls back
+    to this process's own bucket rather than failing the request.
+    """
+
+    def __init__(self, path, rate, burst, name="gemini"):
+        super().__init__(rate, burst)
+        self.name = name
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def try_acquire(self):
+        try:
+            with self._lock:
+                return self._try_acquire_shared()
+        except sqlite3.Error as e:
+            print("Shared rate limiter unavailable, using the in-process bucket:", e)
+            metrics.inc("lpai_llm_rate_limiter_errors_total", {"error": type(e).__name__})
+            return super().try_acquire()
+
+    def _try_acquire_shared(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = self._conn.execute("SELECT tokens, updated FROM token_bucket WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._conn.execute("INSERT OR REPLACE INTO token_bucket (name, tokens, updated) VALUES (?, ?, ?)",
+                               (self.name, tokens, now))
+            self._conn.execute("COMMIT")
+            return wait
+        except Exception:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+
+
+def _acquire_rate_limit(deadline):
+    if llm_rate_limiter is None:
+        return
+    while True:
+        wait = llm_rate_limiter.try_acquire()
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            metrics.inc("lpai_llm_rejected_total", {"reason": "rate_limit"})
+            raise LLMUnavailableError("Gemini rate limit reached", retry_after=wait)
+        time.sleep(wait)
+
+
+if LLM_RATE_PER_MINUTE > 0 and LLM_RATE_LIMIT_DB:
+    llm_rate_limiter = SQLiteTokenBucket(LLM_RATE_LIMIT_DB, LLM_RATE_PER_MINUTE / 60.0, LLM_RATE_BURST)
+elif LLM_RATE_PER_MINUTE > 0:
+    llm_rate_limiter = TokenBucket(LLM_RATE_PER_MINUTE / 60.0, LLM_RATE_BURST)
+else:
+    llm_rate_limiter = None
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model_name):
+    with _breakers_lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = _breakers[model_name] = CircuitBreaker(model_name, LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS)
+        return breaker
+
+
+def _retry_after_seconds(exc):
+    """Server-suggested delay from a Retry-After header or a gRPC RetryInfo detail, if any."""
+    response = getattr(exc, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    for detail in getattr(exc, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def generate_with_retry(model_name, prompt_text, **kwargs):
+    """
+    model.generate_content with timeout, retries, circuit breaker and rate limiting.
+    Raises LLMUnavailableError when Gemini cannot answer within LLM_DEADLINE_SECONDS;
+    non-retryable errors (bad request, safety blocks) propagate unchanged.
+    """
+    deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+    breaker = get_breaker(model_name)
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+        except LLMUnavailableError:
+            metrics.inc("lpai_llm_rejected_total", {"reason": "circuit_open"})
+            raise
+        try:
+            _acquire_rate_limit(deadline)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.inc("lpai_llm_rejected_total", {"reason": "deadline"})
+                raise LLMUnavailableError("Gemini deadline exceeded")
+        except Exception:
+            # rejected (or failed) locally: says nothing about the model, so leave the breaker
+            # state alone, but free a half-open probe slot
+            breaker.cancel_call()
+            raise
+        try:
+            response = get_model(model_name).generate_content(
+                prompt_text, request_options={"timeout": min(LLM_TIMEOUT_SECONDS, remaining)}, **kwargs
+            )
+        except _retryable_llm_errors() as e:
+            breaker.record_failure()
+            attempt += 1
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                # full jitter: uniform in [0, min(cap, base * 2^attempt)]
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+            if attempt > LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise LLMUnavailableError(f"Gemini unavailable: {e}", retry_after=delay)
+            print(f"Gemini retry {attempt}/{LLM_MAX_RETRIES} in {delay:.2f}s:", e)
+            metrics.inc("lpai_llm_retries_total", {"model": model_name})
+            time.sleep(delay)
+            continue
+        except Exception:
+            # the upstream answered (with an error that retrying won't fix)
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+# ------------------- Model Routing -------------------
+# Each route gets a policy: model, max_output_tokens, temperature and, optionally, a faster
+# `fallback` model used for LLM_SLO_COOLDOWN_SECONDS whenever the primary's recent p90
+# latency on that route exceeds `slo_ms` (or the primary is unavailable). Policies are keyed
+# by Flask endpoint, then by call category; LLM_ROUTING_FILE (JSON, same shape) overrides them.
+# Latency and estimated cost are exported per route and model for tuning.
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+LONG_FORM_MODEL = os.getenv("GEMINI_LONG_FORM_MODEL", "gemini-2.0-flash")
+# max_output_tokens caps runaway output only: each is about twice what its prompt asks for
+# (~1.4 tokens per English word), so a complete answer is never cut off.
+MODEL_ROUTES = {
+    "default": {"model": DEFAULT_MODEL, "max_output_tokens": 2048, "temperature": 0.7},
+    # names, taglines, a 120-word paragraph or a palette
+    "branding": {"model": DEFAULT_MODEL, "max_output_tokens": 1024, "temperature": 0.9},
+    # advice plus a daily routine, ~300-400 words
+    "motivation_encouragement": {"model": DEFAULT_MODEL, "max_output_tokens": 1024, "temperature": 1.0},
+    # <50 words
+    "motivation_achievement": {"model": DEFAULT_MODEL, "max_output_tokens": 256, "temperature": 1.0},
+    # three stories of up to 250 words, with titles
+    "motivation_success_stories": {"model": DEFAULT_MODEL, "max_output_tokens": 2560, "temperature": 0.8},
+    "legal": {"model": LONG_FORM_MODEL, "max_output_tokens": 4096, "temperature": 0.2,
+              "fallback": DEFAULT_MODEL, "slo_ms": 15000},
+    # seven detailed analysis sections
+    "ideation_generate": {"model": DEFAULT_MODEL, "max_output_tokens": 3072, "temperature": 0.9},
+    "ideation_validate": {"model": LONG_FORM_MODEL, "max_output_tokens": 4096, "temperature": 0.4,
+                          "fallback": DEFAULT_MODEL, "slo_ms": 20000},
+    "ideation_generate_roadmap": {"model": LONG_FORM_MODEL, "max_output_tokens": 4096, "temperature": 0.4,
+                                  "fallback": DEFAULT_MODEL, "slo_ms": 20000},
+}
+LLM_ROUTING_FILE = os.getenv("LLM_ROUTING_FILE")
+if LLM_ROUTING_FILE:
+    with open(LLM_ROUTING_FILE) as f:
+        for _route, _policy in json.load(f).items():
+            MODEL_ROUTES[_route] = dict(MODEL_ROUTES.get(_route, {}), **_policy)
+LLM_SLO_WINDOW = int(os.getenv("LLM_SLO_WINDOW", "20"))  # recent primary-model calls considered per route
+LLM_SLO_MIN_SAMPLES = int(os.getenv("LLM_SLO_MIN_SAMPLES", "5"))
+LLM_SLO_COOLDOWN_SECONDS = float(os.getenv("LLM_SLO_COOLDOWN_SECONDS", "300"))
+# USD per 1M tokens (input, output); models not listed are accounted at 0.
+LLM_PRICING = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+metrics.describe("lpai_llm_route_seconds", "histogram", "Gemini call latency by route and model.")
+metrics.describe("lpai_llm_cost_usd_total", "counter", "Estimated Gemini spend by route and model.")
+metrics.describe("lpai_llm_truncated_total", "counter", "Gemini answers cut off at max_output_tokens, by route and model.")
+metrics.describe("lpai_llm_slo_fallbacks_total", "counter", "Times a route switched to its fallback model.")
+
+
+def resolve_model_route(category, route=None):
+    """Return (route, policy) for the current request, falling back to the call's category."""
+    route = route or _current_route()
+    if route == "background":
+        route = category
+    policy = MODEL_ROUTES.get(route) or MODEL_ROUTES.get(category) or MODEL_ROUTES["default"]
+    return route, policy
+
+
+def route_generation_config(policy, generation_config=None):
+    """The policy's sampling settings, overridden by anything the caller passes explicitly."""
+    config = {k: policy[k] for k in ("max_output_tokens", "temperature") if k in policy}
+    config.update(generation_config or {})
+    return config
+
+
+class LatencySLO:
+    """Rolling per-route latency of the primary model; switches the route to its fallback on breach."""
+
+    def __init__(self, window, min_samples, cooldown):
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._samples = {}
+        self._degraded_until = {}
+        self._lock = threading.Lock()
+
+    def choose(self, route, policy, primary):
+        if not policy.get("fallback"):
+            return primary
+        with self._lock:
+            degraded = time.monotonic() < self._degraded_until.get(route, 0)
+        return policy["fallback"] if degraded else primary
+
+    def degrade(self, route, reason):
+        with self._lock:
+            self._degraded_until[route] = time.monotonic() + self.cooldown
+            self._samples.pop(route, None)
+        print(f"Model routing: {route} -> fallback for {self.cooldown:.0f}s ({reason})")
+        metrics.inc("lpai_llm_slo_fallbacks_total", {"route": route, "reason": reason})
+
+    def observe(self, route, policy, elapsed):
+        slo_ms = policy.get("slo_ms")
+        if not slo_ms or not policy.get("fallback"):
+            return
+        with self._lock:
+            samples = self._samples.setdefault(route, deque(maxlen=self.window))
+            samples.append(elapsed)
+            if len(samples) < self.min_samples:
+                return
+            p90 = sorted(samples)[int(0.9 * (len(samples) - 1))]
+        if p90 * 1000 > slo_ms:
+            self.degrade(route, "latency")
+
+
+latency_slo = LatencySLO(LLM_SLO_WINDOW, LLM_SLO_MIN_SAMPLES, LLM_SLO_COOLDOWN_SECONDS)
+
+
+def generate_routed(route, policy, primary, prompt_text, **kwargs):
+    """
+    generate_with_retry on the model the routing policy currently picks for `route`.
+    If the primary is unavailable and the route has a fallback, the call is retried there.
+    Returns (response, model_name).
+    """
+    model_name = latency_slo.choose(route, policy, primary)
+    start = time.perf_counter()
+    try:
+        response = generate_with_retry(model_name, prompt_text, **kwargs)
+    except LLMUnavailableError:
+        fallback = policy.get("fallback")
+        if not fallback or model_name == fallback:
+            raise
+        latency_slo.degrade(route, "unavailable")
+        model_name = fallback
+        start = time.perf_counter()
+        response = generate_with_retry(model_name, prompt_text, **kwargs)
+    elapsed = time.perf_counter() - start
+    if not kwargs.get("stream"):
+        metrics.observe("lpai_llm_route_seconds", {"route": route, "model": model_name}, elapsed)
+        if model_name == primary:
+            latency_slo.observe(route, policy, elapsed)
+    return response, model_name
+
+
+# ------------------- LLM Response Cache -------------------
+# Identical prompts (retrying clients, resubmitted ideas) are answered from cache
+# instead of paying another Gemini round trip. Keys are sha256(model, normalized prompt).
+# Seconds a cached response stays valid, per route category.
+LLM_CACHE_TTL = {
+    "branding": 6 * 3600,
+    "legal": 24 * 3600,
+    "motivation": 15 * 60,
+    "ideation": 30 * 60,
+    "ideation_validation": 30 * 60,
+    "ideation_roadmap": 30 * 60,
+    "default": 10 * 60,
+}
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB")  # optional SQLite path for a persistent second tier
+LLM_CACHE_DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "10000"))
+
+
+class MemoryCacheTier:
+    """In-process LRU tier. Entries are (value, expires_at) tuples."""
+
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value, expires_at
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheTier:
+    """
+    On-disk tier so cached responses survive restarts and are shared by workers on one host.
+    Every PURGE_EVERY sets, expired rows are deleted and the table is trimmed to
+    max_entries rows, least recently read first.
+    """
+
+    name = "sqlite"
+    PURGE_EVERY = 64
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+        if "accessed_at" not in columns:
+            # files written before LRU trimming: treat their rows as least recently used
+            self._conn.execute("ALTER TABLE llm_cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._sets = 0
+        self.evictions = 0
+        self.expirations = 0
+        try:
+            with self._lock, self._conn:
+                self._purge()
+        except sqlite3.Error as e:
+            # another worker holds the file; the next periodic purge catches up
+            print("LLM cache purge skipped:", e)
+
+    def get(self, key):
+        # `with self._conn` commits on success and rolls back if a statement fails
+        with self._lock, self._conn:
+            now = time.time()
+            row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.expirations += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def set(self, key, value, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time()),
+            )
+            self._sets += 1
+            if self._sets % self.PURGE_EVERY == 0:
+                self._purge()
+
+    def _purge(self):
+        """Delete expired rows, then trim to max_entries (lock held, inside a transaction)."""
+        self.expirations += self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.evictions += self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (excess,)).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class LLMResponseCache:
+    """
+    Read-through cache in front of Gemini. Tiers are checked in order; a hit in a
+    slower tier is promoted into the faster ones. Any object with get/set can be a tier.
+    A tier that raises (e.g. a locked SQLite file) is logged and counts as a miss, so
+    the cache never fails a request.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "bypassed": 0}
+        self.tier_hits = {t.name: 0 for t in tiers}
+
+    @staticmethod
+    def key(model_name, prompt_text, variant=""):
+        """variant distinguishes calls whose output differs for the same prompt (e.g. generation config)."""
+        normalized = " ".join(prompt_text.split())
+        return hashlib.sha256(f"{model_name}\x00{variant}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def _count(self, name, tier=None):
+        with self._lock:
+            self.counters[name] += 1
+            if tier is not None:
+                self.tier_hits[tier] += 1
+
+    @staticmethod
+    def _tier_error(tier, op, e):
+        print(f"LLM cache tier {tier.name} {op} failed:", e)
+        metrics.inc("lpai_llm_cache_errors_total", {"tier": tier.name, "op": op})
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            try:
+                entry = tier.get(key)
+            except Exception as e:
+                self._tier_error(tier, "get", e)
+                continue
+            if entry is None:
+                continue
+            value, expires_at = entry
+            for faster in self.tiers[:i]:
+                self._set_tier(faster, key, value, expires_at)
+            self._count("hits", tier.name)
+            return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl):
+        expires_at = time.time() + ttl
+        for tier in self.tiers:
+            self._set_tier(tier, key, value, expires_at)
+
+    def _set_tier(self, tier, key, value, expires_at):
+        try:
+            tier.set(key, value, expires_at)
+        except Exception as e:
+            self._tier_error(tier, "set", e)
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, tierHits=dict(self.tier_hits))
+        memory = self.tiers[0]
+        stats["entries"] = len(memory)
+        stats["evictions"] = memory.evictions
+        stats["expirations"] = memory.expirations
+        return stats
+
 
-# Configure the library
-genai.configure(api_key=GEMINI_API_KEY)
+_cache_tiers = [MemoryCacheTier(LLM_CACHE_MAX_ENTRIES)]
+if LLM_CACHE_DB:
+    _cache_tiers.append(SQLiteCacheTier(LLM_CACHE_DB, LLM_CACHE_DB_MAX_ENTRIES))
+llm_cache = LLMResponseCache(_cache_tiers)
 
-# Try to create a client object if available in the installed SDK version.
-# The user earlier mentioned usage: client.models.generate_content(model='gemini-2.5-flash', contents=prompt_text)
-# We attempt that pattern and otherwise fall back to older call patterns.
-try:
-    client = genai.Client()  # will succeed if your google-generativeai version exposes Client()
-except Exception:
-    client = None
+
+def _cache_bypass_requested():
+    """
+    True when the current request asked for a fresh generation, via a
+    `Cache-Control: no-cache` header or `noCache: true` in the body / query string.
+    """
+    if not has_request_context():
+        return False
+    if "no-cache" in request.headers.get("Cache-Control", ""):
+        return True
+    if request.args.get("noCache", "").lower() == "true":
+        return True
+    data = request.get_json(silent=True) or {}
+    return isinstance(data, dict) and bool(data.get("noCache"))
+
+# ------------------- Token Verification Cache -------------------
+# Verified ID tokens are cached by sha256(token) so signature checks (and Google cert
+# fetches) happen once per token, not once per request. Entries never outlive `exp`.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Opt-in: also ask Firebase whether the token was revoked. Revocation needs a network
+# round trip, so cached entries are then only trusted for TOKEN_CACHE_MAX_AGE seconds.
+TOKEN_CHECK_REVOKED = os.getenv("TOKEN_CHECK_REVOKED", "").lower() in ("1", "true", "yes")
+TOKEN_CACHE_MAX_AGE = int(os.getenv("TOKEN_CACHE_MAX_AGE", "60" if TOKEN_CHECK_REVOKED else "3600"))
+
+# AUTH_BACKEND=local accepts HS256 tokens minted by mint_local_token() instead of Firebase
+# ID tokens -- for load tests and benchmarks only, never in production.
+AUTH_BACKEND = os.getenv("AUTH_BACKEND", "firebase")
+LOCAL_AUTH_SECRET = os.getenv("LOCAL_AUTH_SECRET", "")
+if AUTH_BACKEND == "local" and not LOCAL_AUTH_SECRET:
+    raise RuntimeError("AUTH_BACKEND=local requires LOCAL_AUTH_SECRET.")
+
+token_cache = MemoryCacheTier(TOKEN_CACHE_MAX_ENTRIES)
+token_cache_counters = {"hits": 0, "misses": 0}
+_token_counters_lock = threading.Lock()
+
+
+def _b64url(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64url_decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def mint_local_token(uid, ttl=3600, **claims):
+    """Mint an HS256 token accepted when AUTH_BACKEND=local."""
+    now = int(time.time())
+    header = _b64url(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64url(json.dumps(dict(claims, uid=uid, sub=uid, iat=now, exp=now + ttl)).encode())
+    signature = hmac.new(LOCAL_AUTH_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64url(signature)}"
+
+
+def _verify_local_token(token):
+    try:
+        header, payload, signature = token.split(".")
+    except ValueError:
+        raise ValueError("Malformed local token")
+    expected = hmac.new(LOCAL_AUTH_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(_b64url(expected), signature):
+        raise ValueError("Invalid local token signature")
+    claims = json.loads(_b64url_decode(payload))
+    if claims.get("exp", 0) <= time.time():
+        raise ValueError("Local token expired")
+    return claims
+
+
+def _verify_id_token(token):
+    """Verify token (through the cache) and return its decoded claims."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    entry = token_cache.get(key)
+    with _token_counters_lock:
+        token_cache_counters["hits" if entry else "misses"] += 1
+    if entry:
+        return dict(entry[0])
+
+    if AUTH_BACKEND == "local":
+        decoded = _verify_local_token(token)
+    else:
+        decoded = firebase_auth().verify_id_token(token, check_revoked=TOKEN_CHECK_REVOKED)
+    expires_at = min(float(decoded.get("exp", 0)), time.time() + TOKEN_CACHE_MAX_AGE)
+    if expires_at > time.time():
+        token_cache.set(key, decoded, expires_at)
+    return dict(decoded)
+
+
+def token_cache_stats():
+    with _token_counters_lock:
+        stats = dict(token_cache_counters)
+    stats.update(entries=len(token_cache), evictions=token_cache.evictions, expirations=token_cache.expirations)
+    return stats
+
+# ------------------- Admission Control -------------------
+# Authenticated requests take a slot in their route class before the view runs: "llm"
+# for the /assistant/* routes (except the whiteboard), "datastore" for everything else.
+# When a class is full, requests wait in a bounded queue that hands freed slots to users
+# round-robin, so one heavy user cannot starve the others, and a user already holding
+# ADMISSION_MAX_PER_USER slots + queue places in the class is refused with 429. A request is turned away at
+# once with 503 + Retry-After when the queue is full or its expected wait (queue position x
+# recent service time / slots) exceeds the class's max wait, instead of tying up a worker
+# thread until it times out. Queued requests also hold a thread, so under gunicorn keep the
+# llm slots + queue well below GUNICORN_THREADS; that headroom is what keeps CRUD fast
+# while Gemini is slow. A limit of 0 disables admission control for that class.
+ADMISSION_LLM_LIMIT = int(os.getenv("ADMISSION_LLM_LIMIT", "32"))
+ADMISSION_LLM_QUEUE = int(os.getenv("ADMISSION_LLM_QUEUE", "16"))
+ADMISSION_LLM_MAX_WAIT = float(os.getenv("ADMISSION_LLM_MAX_WAIT", "10"))  # seconds
+ADMISSION_DB_LIMIT = int(os.getenv("ADMISSION_DB_LIMIT", "64"))
+ADMISSION_DB_QUEUE = int(os.getenv("ADMISSION_DB_QUEUE", "64"))
+ADMISSION_DB_MAX_WAIT = float(os.getenv("ADMISSION_DB_MAX_WAIT", "2"))
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER", "8"))  # slots + queue places per class
+metrics.describe("lpai_admission_total", "counter", "Admission decisions by route class and outcome.")
+metrics.describe("lpai_admission_wait_seconds", "histogram", "Time admitted requests spent queued, by route class.")
+
+
+class _Waiter:
+    def __init__(self, uid):
+        self.uid = uid
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """Concurrency limit for one route class, with a bounded per-user round-robin wait queue."""
+
+    def __init__(self, name, limit, max_queue, max_wait, max_per_user):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_per_user = max_per_user
+        self.active = 0
+        self.queued = 0
+        self.service_seconds = None  # moving average of admitted requests' duration
+        self._per_user = {}  # uid -> active + queued
+        self._queues = OrderedDict()  # uid -> deque of _Waiter; served front to back, then moved to the end
+        self._lock = threading.Lock()
+
+    def expected_wait(self, position):
+        """Seconds until the request at queue `position` (1-based) gets a slot; 0 if unknown."""
+        if self.service_seconds is None:
+            return 0.0
+        return position / self.limit * self.service_seconds
+
+    def acquire(self, uid):
+        """Take a slot, waiting if needed. Returns None when admitted, else (status, retry_after, reason)."""
+        start = time.monotonic()
+        with self._lock:
+            if self.active < self.limit and not self.queued:
+                self._admit(uid)
+                self._count("admitted")
+                return None
+            if self._per_user.get(uid, 0) >= self.max_per_user:
+                return self._reject(429, self.expected_wait(1), "user_limit")
+            if self.queued >= self.max_queue:
+                return self._reject(503, self.expected_wait(self.queued + 1), "queue_full")
+            wait = self.expected_wait(self.queued + 1)
+            if wait > self.max_wait:
+                return self._reject(503, wait, "deadline")
+            waiter = _Waiter(uid)
+            self._queues.setdefault(uid, deque()).append(waiter)
+            self._per_user[uid] = self._per_user.get(uid, 0) + 1
+            self.queued += 1
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if not waiter.granted:
+                queue = self._queues[uid]
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[uid]
+                self._leave(uid)
+                self.queued -= 1
+                return self._reject(503, self.expected_wait(self.queued + 1), "timeout")
+        metrics.observe("lpai_admission_wait_seconds", {"class": self.name}, time.monotonic() - start)
+        self._count("admitted_after_wait")
+        return None
+
+    def release(self, uid, elapsed):
+        with self._lock:
+            self.service_seconds = elapsed if self.service_seconds is None else 0.8 * self.service_seconds + 0.2 * elapsed
+            self.active -= 1
+            self._leave(uid)
+            while self.active < self.limit and self._queues:
+                queued_uid, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(queued_uid)
+                else:
+                    del self._queues[queued_uid]
+                self.queued -= 1
+                self.active += 1  # per-user count carries over from the queue place
+                waiter.granted = True
+                waiter.event.set()
+
+    def _admit(self, uid):
+        self.active += 1
+        self._per_user[uid] = self._per_user.get(uid, 0) + 1
+
+    def _leave(self, uid):
+        if self._per_user[uid] <= 1:
+            del self._per_user[uid]
+        else:
+            self._per_user[uid] -= 1
+
+    def _reject(self, status, wait, reason):
+        self._count("rejected_" + reason)
+        return status, max(1, int(wait + 0.999)), reason
+
+    def _count(self, outcome):
+        metrics.inc("lpai_admission_total", {"class": self.name, "outcome": outcome})
+
+    def stats(self):
+        with self._lock:
+            return {"active": self.active, "queued": self.queued, "limit": self.limit, "queueLimit": self.max_queue,
+                    "users": len(self._per_user), "serviceSeconds": round(self.service_seconds or 0.0, 4)}
+
+
+admission = {
+    name: AdmissionController(name, limit, queue, max_wait, ADMISSION_MAX_PER_USER)
+    for name, limit, queue, max_wait in (
+        ("llm", ADMISSION_LLM_LIMIT, ADMISSION_LLM_QUEUE, ADMISSION_LLM_MAX_WAIT),
+        ("datastore", ADMISSION_DB_LIMIT, ADMISSION_DB_QUEUE, ADMISSION_DB_MAX_WAIT),
+    )
+    if limit > 0
+}
+
+
+def _route_class():
+    path = request.path
+    if path.startswith("/assistant/") and not path.startswith("/assistant/whiteboard/"):
+        return "llm"
+    return "datastore"
+
+
+def admit_request(uid):
+    """Admission for the current request; returns a 429/503 response if it is turned away."""
+    controller = admission.get(_route_class())
+    if controller is None:
+        return None
+    with span("admission"):
+        rejected = controller.acquire(uid)
+    if rejected is None:
+        g.admission = (controller, uid, time.monotonic())
+        return None
+    status, retry_after, reason = rejected
+    return (jsonify({"error": "Server busy, retry later" if status == 503 else "Too many requests in progress",
+                     "reason": reason, "retryAfter": retry_after}),
+            status, {"Retry-After": str(retry_after)})
+
+
+@api.teardown_app_request
+def _release_admission(exc):
+    # teardown runs after a streamed body has been sent, so SSE/export hold their slot throughout
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        controller, uid, start = ticket
+        controller.release(uid, time.monotonic() - start)
 
 # ------------------- Authentication Decorator -------------------
 def verify_firebase_token(f):
@@ -56,61 +1936,1018 @@ def verify_firebase_token(f):
             if not auth_header.startswith("Bearer "):
                 raise ValueError("Authorization header missing or malformed")
             token = auth_header.split("Bearer ")[1]
-            decoded_token = auth.verify_id_token(token)
+            with span("auth"):
+                decoded_token = _verify_id_token(token)
             request.user = decoded_token  # contains uid, email, etc.
-            return f(*args, **kwargs)
         except Exception as e:
             return jsonify({"error": "Unauthorized", "details": str(e)}), 401
+        rejected = admit_request(request.user["uid"])
+        if rejected is not None:
+            return rejected
+        # errors raised by the view itself go to the app's error handlers, not a 401
+        return f(*args, **kwargs)
     return wrapper
 
 # ------------------- Helper: call Gemini (robust parsing) -------------------
-def call_gemini(prompt_text, model_name="gemini-2.0-flash-lite"):
+def _response_text(response):
+    """Extract text from a generate_content response across SDK versions."""
+    if hasattr(response, "text"):
+        return response.text.strip()
+    elif hasattr(response, "candidates"):
+        # Combine candidate texts if multiple
+        texts = []
+        for c in response.candidates:
+            if hasattr(c, "content") and hasattr(c.content, "parts"):
+                texts.extend([p.text for p in c.content.parts if hasattr(p, "text")])
+        return "\n".join(texts)
+    else:
+        return str(response)
+
+
+def _record_llm_usage(model_name, prompt_text, output, usage, outcome="ok", route=None):
+    labels = {"model": model_name}
+    metrics.inc("lpai_llm_calls_total", dict(labels, outcome=outcome))
+    metrics.inc("lpai_llm_prompt_chars_total", labels, len(prompt_text))
+    metrics.inc("lpai_llm_response_chars_total", labels, len(output))
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        metrics.inc("lpai_llm_prompt_tokens_total", labels, prompt_tokens)
+        metrics.inc("lpai_llm_output_tokens_total", labels, output_tokens)
+        input_price, output_price = LLM_PRICING.get(model_name, (0, 0))
+        cost = (prompt_tokens * input_price + output_tokens * output_price) / 1e6
+        metrics.inc("lpai_llm_cost_usd_total", {"route": route or _current_route(), "model": model_name}, cost)
+
+
+def _cache_lookup(prompt_text, model_name, use_cache, generation_config=None):
+    """Returns (cache_key, cached_text_or_None), honouring the per-request bypass flag."""
+    if use_cache is None:
+        use_cache = not _cache_bypass_requested()
+    variant = json.dumps(generation_config, sort_keys=True) if generation_config else ""
+    cache_key = llm_cache.key(model_name, prompt_text, variant)
+    if not use_cache:
+        llm_cache.record_bypass()
+        return cache_key, None
+    return cache_key, llm_cache.get(cache_key)
+
+
+def _finish_reason(response):
+    """Name of the first candidate's finish reason ("STOP", "MAX_TOKENS", ...), or None."""
+    try:
+        reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return None
+    if isinstance(reason, int) and not hasattr(reason, "name"):
+        return {1: "STOP", 2: "MAX_TOKENS"}.get(reason)
+    return getattr(reason, "name", reason)
+
+
+def call_gemini(prompt_text, model_name=None, category="default", use_cache=None,
+                generation_config=None, cache_if=None, route=None):
     """
     Calls Gemini model using the latest Google Generative AI SDK.
-    Compatible with 'gemini-2.0-flash-lite' or 'gemini-1.5-pro'.
-    Returns clean text output or formatted error.
+    The model and sampling settings come from the route's MODEL_ROUTES policy (the current
+    endpoint unless `route` is given) unless model_name / generation_config say otherwise.
+    Returns clean text output; raises LLMError (502) or LLMUnavailableError (503) on failure,
+    so error text is never persisted as an output. JSON-mode output cut off at
+    max_output_tokens is also a 503, rather than being repaired and saved.
+
+    Responses are cached per (primary model, generation_config, prompt) for
+    LLM_CACHE_TTL[category] seconds, so a fallback answer also serves later requests.
+    use_cache=None follows the request's bypass flag; errors are never cached, and
+    neither is output for which cache_if(output) is false.
     """
+    route, policy = resolve_model_route(category, route)
+    model_name = model_name or policy["model"]
+    generation_config = route_generation_config(policy, generation_config)
+    cache_key, cached = _cache_lookup(prompt_text, model_name, use_cache, generation_config)
+    if cached is not None:
+        return cached
+
+    used_model = model_name
     try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt_text)
-
-        # Extract text depending on SDK version
-        if hasattr(response, "text"):
-            return response.text.strip()
-        elif hasattr(response, "candidates"):
-            # Combine candidate texts if multiple
-            texts = []
-            for c in response.candidates:
-                if hasattr(c, "content") and hasattr(c.content, "parts"):
-                    texts.extend([p.text for p in c.content.parts if hasattr(p, "text")])
-            return "\n".join(texts)
-        else:
-            return str(response)
+        with span("gemini"):
+            response, used_model = generate_routed(route, policy, model_name, prompt_text,
+                                                   generation_config=generation_config)
+        output = _response_text(response)
+    except LLMError as e:
+        print("Gemini API error:", e)
+        _record_llm_usage(used_model, prompt_text, "", None, outcome="unavailable", route=route)
+        raise
     except Exception as e:
         print("Gemini API error:", e)
-        return f"Error (Gemini): {e}"
+        _record_llm_usage(used_model, prompt_text, "", None, outcome="error", route=route)
+        raise LLMError(f"Gemini error: {e}")
+    _record_llm_usage(used_model, prompt_text, output, getattr(response, "usage_metadata", None), route=route)
+    if _finish_reason(response) == "MAX_TOKENS":
+        metrics.inc("lpai_llm_truncated_total", {"route": route, "model": used_model})
+        if generation_config.get("response_mime_type") == "application/json":
+            # cut-off JSON is not worth repairing or saving; the client can retry
+            raise LLMUnavailableError(f"Gemini output truncated at {generation_config.get('max_output_tokens')} tokens",
+                                      retry_after=1)
+
+    if cache_if is None or cache_if(output):
+        llm_cache.set(cache_key, output, LLM_CACHE_TTL.get(category, LLM_CACHE_TTL["default"]))
+    return output
+
+
+def call_gemini_stream(prompt_text, model_name=None, category="default", use_cache=None):
+    """
+    Generator version of call_gemini: yields text chunks as Gemini produces them.
+    A cache hit is yielded as a single chunk. API errors are raised so the caller
+    can report them to the client instead of persisting them.
+    """
+    route, policy = resolve_model_route(category)
+    model_name = model_name or policy["model"]
+    generation_config = route_generation_config(policy)
+    cache_key, cached = _cache_lookup(prompt_text, model_name, use_cache, generation_config)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    usage = None
+    used_model = model_name
+    start = time.perf_counter()
+    try:
+        # retries only cover opening the stream; a failure mid-stream is reported to the client
+        chunks, used_model = generate_routed(route, policy, model_name, prompt_text, stream=True,
+                                             generation_config=generation_config)
+        for chunk in chunks:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            try:
+                text = chunk.text
+            except (AttributeError, ValueError):
+                # chunks without text parts (e.g. safety/finish metadata)
+                continue
+            if text:
+                parts.append(text)
+                yield text
+    except Exception:
+        _record_llm_usage(used_model, prompt_text, "".join(parts), usage, outcome="error", route=route)
+        raise
+    finally:
+        _record_span("gemini_stream", time.perf_counter() - start)
+    metrics.observe("lpai_llm_route_seconds", {"route": route, "model": used_model}, time.perf_counter() - start)
+    output = "".join(parts).strip()
+    _record_llm_usage(used_model, prompt_text, output, usage, route=route)
+    llm_cache.set(cache_key, output, LLM_CACHE_TTL.get(category, LLM_CACHE_TTL["default"]))
+
+
+# ------------------- Helper: Server-Sent Events -------------------
+def _stream_requested(data):
+    """Streaming is opt-in: `stream: true` in the body, `?stream=true`, or Accept: text/event-stream."""
+    if getattr(request, "job_id", None):
+        return False  # running as a background job; the result is polled, not streamed
+    if isinstance(data, dict) and data.get("stream"):
+        return True
+    if request.args.get("stream", "").lower() == "true":
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_llm_response(prompt_text, category, finalize, text=None):
+    """
+    Server-Sent Events response for a long-form generation.
+    Emits `chunk` events ({"text": ...}) as Gemini produces output, then calls
+    finalize(full_text) -- which builds the route's usual JSON body and persists it --
+    and sends that body as the `done` event. Failures are sent as an `error` event.
+    Output that is already available (e.g. pre-generated) is passed as `text` and
+    sent as a single chunk without calling Gemini.
+    """
+    def events():
+        parts = []
+        chunks = [text] if text is not None else call_gemini_stream(prompt_text, category=category)
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield _sse("chunk", {"text": chunk})
+            yield _sse("done", finalize("".join(parts).strip()))
+        except Exception as e:
+            print("Streaming error:", e)
+            yield _sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
+# ------------------- Async Jobs -------------------
+# Slow LLM routes can run on a bounded worker pool instead of holding a request thread.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))  # queued + running jobs per uid
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))  # how long finished results stay pollable
+
+
+class InMemoryJobStore:
+    """
+    Job records kept in process memory. Another backend (e.g. Redis) only needs the
+    same create/update/get methods; keys starting with "_" are internal bookkeeping.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, owner, route, max_active):
+        """Registers a queued job, or returns None if owner already has max_active unfinished jobs."""
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job["_expires"] < now]:
+                del self._jobs[job_id]
+            active = sum(1 for job in self._jobs.values()
+                         if job["owner"] == owner and job["status"] in ("queued", "running"))
+            if active >= max_active:
+                return None
+            job = {
+                "jobID": str(uuid.uuid4()),
+                "owner": owner,
+                "route": route,
+                "status": "queued",
+                "createdAt": datetime.utcnow().isoformat(),
+                "finishedAt": None,
+                "httpStatus": None,
+                "result": None,
+                "_expires": float("inf"),
+            }
+            self._jobs[job["jobID"]] = job
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if fields.get("status") in ("succeeded", "failed"):
+                job["finishedAt"] = datetime.utcnow().isoformat()
+                job["_expires"] = time.time() + self.ttl
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+job_store = InMemoryJobStore(JOB_TTL_SECONDS)
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="lpai-job")
+
+
+def _fanout_workers(env_name, fanout):
+    """
+    Thread count for a pool that runs one route's concurrent Gemini calls: by default enough
+    for every admitted LLM request plus every async job to run all `fanout` calls at once,
+    so requests never queue behind each other inside the pool. Without an LLM admission
+    limit, 64 concurrent requests (the default GUNICORN_THREADS) are assumed.
+    """
+    concurrent = (ADMISSION_LLM_LIMIT or 64) + JOB_WORKERS
+    return int(os.getenv(env_name, str(concurrent * fanout)))
+
+
+def _async_requested(data):
+    if isinstance(data, dict) and data.get("async"):
+        return True
+    return request.args.get("async", "").lower() == "true"
+
+
+def async_job(f):
+    """
+    Opt-in background execution (`async: true` in the body or `?async=true`).
+    The view runs unchanged on the job pool with a copy of the request context, so
+    saving still goes through _update_project_output; the client polls /jobs/<jobID>.
+    Must sit below @verify_firebase_token.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        # parse the body now so the worker's copy of the request sees the cached JSON
+        data = request.get_json(silent=True)
+        if not _async_requested(data):
+            return f(*args, **kwargs)
+        if draining.is_set():
+            return jsonify({"error": "Server is shutting down"}), 503, {"Retry-After": "5"}
+        job = job_store.create(request.user["uid"], request.path, JOB_MAX_PER_USER)
+        if job is None:
+            return jsonify({"error": "Too many jobs in progress", "limit": JOB_MAX_PER_USER}), 429
+        job_id = job["jobID"]
+
+        @copy_current_request_context
+        def run():
+            request.job_id = job_id
+            job_store.update(job_id, status="running")
+            try:
+                resp = current_app.make_response(f(*args, **kwargs))
+                job_store.update(
+                    job_id,
+                    status="succeeded" if resp.status_code < 400 else "failed",
+                    httpStatus=resp.status_code,
+                    result=resp.get_json(silent=True),
+                )
+            except (LLMError, NotFoundError) as e:
+                resp = current_app.make_response(current_app.handle_user_exception(e))
+                job_store.update(job_id, status="failed", httpStatus=resp.status_code, result=resp.get_json(silent=True))
+            except Exception as e:
+                print("Job error:", job_id, e)
+                job_store.update(job_id, status="failed", httpStatus=500, result={"error": str(e)})
+            finally:
+                background_work.done()
+
+        # counted from submission so drain() also waits for queued jobs
+        background_work.start()
+        job_executor.submit(run)
+        return jsonify({"jobID": job_id, "status": "queued", "statusURL": f"/jobs/{job_id}"}), 202
+    return wrapper
+
+# ------------------- Helper: Saved Outputs & Notes -------------------
+# API responses expose saved outputs and notes as one `savedOutputs` list. Projects
+# created before they moved to subcollections keep a legacy `savedOutputs` array until
+# `flask --app app migrate-saved-outputs` moves it.
+_INTERNAL_ITEM_FIELDS = ("projectID", "legacyIndex")
+
+
+def _saved_output_doc(projectID, category, output, savedAt):
+    return {"projectID": projectID, "type": category, "content": output, "savedAt": savedAt}
+
+
+def _merge_saved_items(legacy, docs):
+    """Legacy array items first, then subcollection docs oldest-first, minus internal fields."""
+    docs = sorted(docs, key=lambda d: (d.get("savedAt") or d.get("createdAt") or "", d.get("legacyIndex", 0)))
+    items = list(legacy or [])
+    for d in docs:
+        items.append({k: v for k, v in d.items() if k not in _INTERNAL_ITEM_FIELDS})
+    return items
+
+
+@api.cli.command("migrate-saved-outputs")
+@click.option("--project", "project_ids", multiple=True, help="Only migrate these project IDs.")
+@click.option("--dry-run", is_flag=True, help="Count items without writing.")
+def migrate_saved_outputs(project_ids, dry_run):
+    """Move legacy savedOutputs arrays into the savedOutputs/notes subcollections."""
+    if DATA_BACKEND != "firestore":
+        raise click.ClickException("migrate-saved-outputs only applies to DATA_BACKEND=firestore")
+    projects = items = 0
+    for projectID, moved in project_store.migrate_legacy_saved_outputs(list(project_ids), dry_run):
+        if moved:
+            projects += 1
+            items += moved
+            click.echo(f"{projectID}: {moved} items")
+    click.echo(f"{'Would migrate' if dry_run else 'Migrated'} {items} items across {projects} projects")
+
+@api.cli.command("backfill-context-summaries")
+@click.option("--project", "project_ids", multiple=True, help="Only backfill these project IDs.")
+@click.option("--dry-run", is_flag=True, help="Count outputs without writing.")
+def backfill_context_summaries(project_ids, dry_run):
+    """Write contextSummary for outputs saved before prompt summaries existed."""
+    if DATA_BACKEND != "firestore":
+        raise click.ClickException("backfill-context-summaries only applies to DATA_BACKEND=firestore")
+    projects = outputs = 0
+    for projectID, count in project_store.backfill_context_summaries(list(project_ids), dry_run):
+        if count:
+            projects += 1
+            outputs += count
+    click.echo(f"{'Would summarize' if dry_run else 'Summarized'} {outputs} outputs across {projects} projects")
+
+# ------------------- Helper: Prompt Budgeting -------------------
+# Project data interpolated into prompts is compacted and trimmed to a token budget.
+# Each lastOutputs entry gets a short text summary, stored on the project as
+# contextSummary.<category> whenever that output is written, so prompts read the small
+# summaries instead of full reports and roadmaps.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))  # project context per prompt
+CONTEXT_SUMMARY_CHARS = int(os.getenv("CONTEXT_SUMMARY_CHARS", "600"))  # per lastOutputs category
+PROMPT_MAX_ACHIEVEMENTS = 10  # most recent achievements quoted in prompts
+_SUMMARY_SKIP_KEYS = {"createdAt", "timestamp", "type", "projectID", "savedAt"}
+metrics.describe("lpai_prompt_tokens_total", "counter", "Estimated prompt tokens sent, by route.")
+metrics.describe("lpai_prompt_tokens_trimmed_total", "counter", "Estimated prompt tokens removed by budgeting, by route.")
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return (len(text) + 3) // 4
+
+
+def _truncate(text, max_chars):
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars].rstrip(" ,;:") + " …"
+
+
+def _compact(value):
+    """Plain-text rendering of an output: leaf values only, no repr noise or bookkeeping keys."""
+    if isinstance(value, dict):
+        if isinstance(value.get("steps"), list):  # roadmap: the phase names carry the gist
+            return "; ".join(_compact(step.get("name", step) if isinstance(step, dict) else step) for step in value["steps"])
+        return "; ".join(f"{k}: {_compact(v)}" for k, v in value.items() if k not in _SUMMARY_SKIP_KEYS and v not in (None, "", [], {}))
+    if isinstance(value, list):
+        return ", ".join(_compact(v) for v in value)
+    return str(value)
+
+
+def summarize_output(output, max_chars=CONTEXT_SUMMARY_CHARS):
+    """Short text summary of one lastOutputs entry."""
+    return _truncate(_compact(output), max_chars)
+
+
+def build_budgeted_prompt(instructions, sections, budget_tokens=PROMPT_TOKEN_BUDGET, footer=""):
+    """
+    instructions + labelled sections + footer, with the sections trimmed to budget_tokens.
+    Sections under their fair share keep their full text; the rest split what is left.
+    Returns (prompt_text, estimated_tokens) and records both in the prompt metrics.
+    """
+    sections = [(label, text) for label, text in sections if text]
+    budget = budget_tokens * 4  # in characters
+    allowed = {}
+    pending = sorted(sections, key=lambda s: len(s[1]))
+    while pending:
+        share = budget // len(pending)
+        label, text = pending[0]
+        if len(text) > share:
+            break
+        allowed[label] = len(text)
+        budget -= len(text)
+        pending.pop(0)
+    for label, _ in pending:
+        allowed[label] = max(budget // len(pending), 40)
+    body = "".join(f"{label}: {_truncate(text, allowed[label])}\n" for label, text in sections)
+    prompt = f"{instructions}\n\n{body}\n{footer}".strip()
+    tokens = estimate_tokens(prompt)
+    full = estimate_tokens(f"{instructions}\n\n" + "".join(f"{label}: {text}\n" for label, text in sections) + footer)
+    labels = {"route": _current_route()}
+    metrics.inc("lpai_prompt_tokens_total", labels, tokens)
+    metrics.inc("lpai_prompt_tokens_trimmed_total", labels, max(0, full - tokens))
+    return prompt, tokens
+
+
+def project_context_sections(pdata):
+    """Budget-ready (label, text) sections for a project's name, recent achievements and outputs."""
+    achievements = [a.get("text", "") if isinstance(a, dict) else str(a) for a in pdata.get("achievements", [])]
+    recent = achievements[-PROMPT_MAX_ACHIEVEMENTS:]
+    achievement_text = "; ".join(reversed(recent))
+    if len(achievements) > len(recent):
+        achievement_text += f" (and {len(achievements) - len(recent)} earlier)"
+    summaries = pdata.get(CONTEXT_SUMMARY)
+    if summaries is None:
+        # projects whose outputs predate contextSummary
+        summaries = {c: summarize_output(o) for c, o in (pdata.get("lastOutputs") or {}).items()}
+    sections = [("Project name", pdata.get("projectName") or ""), ("Achievements (most recent first)", achievement_text)]
+    sections += [(f"Recent {category} output", summary) for category, summary in sorted(summaries.items())]
+    return sections
+
 # ------------------- Helper: Update Project Output -------------------
+# OUTPUT_WRITE_BEHIND_MS > 0 buffers assistant outputs per project for that long and
+# commits everything that arrived in the window as one write. Reads of lastOutputs may
+# then lag by up to the window, and a missing project is only logged, not raised.
+OUTPUT_WRITE_BEHIND_MS = float(os.getenv("OUTPUT_WRITE_BEHIND_MS", "0"))
+metrics.describe("lpai_output_writes_total", "counter", "Assistant outputs handed to _update_project_output(s).")
+metrics.describe("lpai_output_commits_total", "counter", "Datastore commits made for assistant outputs.")
+
+
+class OutputWriteBuffer:
+    """Coalesces outputs for the same project written within `window` seconds into one commit."""
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}  # projectID -> (lastOutputs by category, saved docs)
+        self._lock = threading.Lock()
+
+    def add(self, projectID, last_outputs, saved_docs):
+        with self._lock:
+            entry = self._pending.get(projectID)
+            if entry is None:
+                entry = self._pending[projectID] = ({}, [])
+                timer = threading.Timer(self.window, self.flush, args=(projectID,))
+                timer.daemon = True
+                timer.start()
+            entry[0].update(last_outputs)
+            entry[1].extend(saved_docs)
+
+    def flush(self, projectID):
+        with self._lock:
+            entry = self._pending.pop(projectID, None)
+        if entry is None:
+            return
+        try:
+            _commit_outputs(projectID, *entry)
+        except Exception as e:
+            print("Write-behind flush failed:", projectID, e)
+
+    def flush_all(self):
+        with self._lock:
+            project_ids = list(self._pending)
+        for projectID in project_ids:
+            self.flush(projectID)
+
+
+output_buffer = OutputWriteBuffer(OUTPUT_WRITE_BEHIND_MS / 1000.0) if OUTPUT_WRITE_BEHIND_MS > 0 else None
+if output_buffer:
+    atexit.register(output_buffer.flush_all)
+
+
+def _commit_outputs(projectID, last_outputs, saved_docs):
+    # the prompt summary of each category is refreshed in the same write as its output
+    summaries = {category: summarize_output(output) for category, output in last_outputs.items()}
+    with span("update_project_output"):
+        metrics.inc("lpai_output_commits_total", {})
+        project_store.record_outputs(projectID, last_outputs, saved_docs, summaries)
+
+
 def _update_project_output(projectID, category, output, save=False):
     """
     Writes lastOutputs.<category> = output
-    If save True, append to savedOutputs (keeps as array).
-    """
-    proj_ref = db.collection("projects").document(projectID)
-    # ensure doc exists
-    doc = proj_ref.get()
-    if not doc.exists:
-        raise ValueError("Project not found")
-    # update lastOutputs
-    proj_ref.update({f"lastOutputs.{category}": output})
-    # append to savedOutputs if requested
+    If save True, add a doc to the project's savedOutputs subcollection.
+    Both happen in one atomic write that fails with ValueError if the project is missing.
+    """
+    _update_project_outputs(projectID, category, [output], save)
+
+def _update_project_outputs(projectID, category, outputs, save=False):
+    """
+    Batch form of _update_project_output for several outputs of one category.
+    lastOutputs.<category> ends up as the last output (as if the calls ran in order)
+    and every output is appended to savedOutputs, all in a single write batch.
+    """
+    saved_docs = []
     if save:
         savedAt = datetime.utcnow().isoformat()
-        proj_ref.update({"savedOutputs": firestore.ArrayUnion([{"type": category, "content": output, "savedAt": savedAt}])})
+        saved_docs = [_saved_output_doc(projectID, category, output, savedAt) for output in outputs]
+    metrics.inc("lpai_output_writes_total", {}, len(outputs))
+    if output_buffer:
+        output_buffer.add(projectID, {category: outputs[-1]}, saved_docs)
+    else:
+        _commit_outputs(projectID, {category: outputs[-1]}, saved_docs)
+
+# ------------------- Helper: Pre-generated Content -------------------
+# Endpoints whose prompt never changes are served from a pool of PREGEN_VARIANTS outputs
+# kept warm by a background thread (started on first use, so it runs in each worker
+# process) and regenerated every PREGEN_REFRESH_SECONDS. Users rotate through the
+# variants; an empty pool falls back to a live Gemini call, whose output seeds the pool.
+PREGEN_VARIANTS = int(os.getenv("PREGEN_VARIANTS", "5"))  # 0 disables pre-generation
+PREGEN_REFRESH_SECONDS = int(os.getenv("PREGEN_REFRESH_SECONDS", "3600"))
+PREGEN_MAX_USERS = 10000  # per-user rotation cursors kept per pool
+metrics.describe("lpai_pregen_requests_total", "counter", "Pre-generated content lookups by pool and outcome.")
+metrics.describe("lpai_pregen_refreshes_total", "counter", "Background pool regenerations by pool and outcome.")
+
+
+class VariantPool:
+    """Pre-generated outputs for one fixed prompt, rotated per user."""
+
+    def __init__(self, name, prompt_text, category, route, size=PREGEN_VARIANTS, refresh_seconds=PREGEN_REFRESH_SECONDS):
+        self.name = name
+        self.prompt_text = prompt_text
+        self.category = category
+        self.route = route
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self.refreshed_at = 0.0
+        self._variants = []
+        self._cursors = OrderedDict()  # uid -> index of that user's next variant
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        """Next variant for uid, or None when the pool is empty (the caller generates live)."""
+        _start_pregen_worker()
+        with self._lock:
+            if not self._variants:
+                metrics.inc("lpai_pregen_requests_total", {"pool": self.name, "outcome": "miss"})
+                return None
+            index = self._cursors.pop(uid, None)
+            if index is None:
+                index = int(hashlib.sha1(uid.encode()).hexdigest(), 16) % len(self._variants)
+            self._cursors[uid] = index + 1
+            if len(self._cursors) > PREGEN_MAX_USERS:
+                self._cursors.popitem(last=False)
+            metrics.inc("lpai_pregen_requests_total", {"pool": self.name, "outcome": "hit"})
+            return self._variants[index % len(self._variants)]
+
+    def offer(self, text):
+        """Seed an empty pool with a live-generated output."""
+        with self._lock:
+            if len(self._variants) < self.size:
+                self._variants.append(text)
+
+    def stale(self):
+        return len(self._variants) < self.size or time.time() - self.refreshed_at >= self.refresh_seconds
+
+    def refresh(self):
+        """Generate a fresh set of variants; on failure the current ones keep being served."""
+        try:
+            variants = [
+                call_gemini(self.prompt_text, category=self.category, use_cache=False, route=self.route)
+                for _ in range(self.size)
+            ]
+        except LLMError as e:
+            print("Pre-generation failed:", self.name, e)
+            metrics.inc("lpai_pregen_refreshes_total", {"pool": self.name, "outcome": "error"})
+            return False
+        with self._lock:
+            self._variants = variants
+            self.refreshed_at = time.time()
+        metrics.inc("lpai_pregen_refreshes_total", {"pool": self.name, "outcome": "ok"})
+        return True
+
+
+variant_pools = []
+_pregen_worker = None
+_pregen_lock = threading.Lock()
+
+
+def _pregen_loop():
+    while not draining.is_set():
+        for pool in variant_pools:
+            if pool.stale() and not draining.is_set():
+                with background_work.track():
+                    pool.refresh()
+        draining.wait(min(60, PREGEN_REFRESH_SECONDS))
+
+
+def _start_pregen_worker():
+    global _pregen_worker
+    if _pregen_worker is not None or PREGEN_VARIANTS <= 0:
+        return
+    with _pregen_lock:
+        if _pregen_worker is None:
+            _pregen_worker = threading.Thread(target=_pregen_loop, name="pregen", daemon=True)
+            _pregen_worker.start()
+
+
+def pregenerated(pool, uid):
+    """A pooled variant for uid, or a live generation (which also seeds the pool)."""
+    if PREGEN_VARIANTS > 0:
+        text = pool.get(uid)
+        if text is not None:
+            return text
+    text = call_gemini(pool.prompt_text, category=pool.category, route=pool.route)
+    if PREGEN_VARIANTS > 0:
+        pool.offer(text)
+    return text
+
+# ------------------- Helper: Near-duplicate Ideas -------------------
+# generateIdea / validateIdea keep a per-project MinHash index of the idea text they were
+# given. A resubmission whose word-shingle Jaccard similarity to an earlier one is at least
+# IDEA_DEDUP_THRESHOLD reuses that result instead of a new long-form generation, unless
+# the request says otherwise (`onDuplicate`: "reuse" | "revise" | "regenerate", or the
+# usual noCache bypass). "revise" asks Gemini to update the earlier result for just the
+# changed inputs. The index lives in process memory.
+IDEA_DEDUP_THRESHOLD = float(os.getenv("IDEA_DEDUP_THRESHOLD", "0.8"))  # 0 disables the index
+IDEA_DEDUP_MAX_PER_PROJECT = 50
+IDEA_DEDUP_MAX_PROJECTS = 2000
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # LSH: 16 bands of 4 rows; pairs at J >= 0.8 collide in some band with p > 0.999
+_MERSENNE_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240611)  # fixed, so signatures are comparable across restarts
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1, _MERSENNE_PRIME), _minhash_rng.randrange(_MERSENNE_PRIME))
+                   for _ in range(MINHASH_PERMUTATIONS)]
+metrics.describe("lpai_idea_dedup_total", "counter", "Ideation requests checked for near-duplicates, by outcome.")
+
+
+def _normalize_idea_text(text):
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower()).strip()
+
+
+def idea_shingles(text, k=3):
+    """Set of hashed k-word shingles of the normalized text (single words for very short texts)."""
+    words = _normalize_idea_text(text).split()
+    grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)] or words
+    return {zlib.crc32(g.encode()) for g in grams}
+
+
+def minhash_signature(shingles):
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in shingles) for a, b in _MINHASH_PARAMS)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index of (idea text -> result) per (scope, kind), LRU-bounded."""
+
+    def __init__(self, threshold, max_per_scope, max_scopes):
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        self.max_scopes = max_scopes
+        self._scopes = OrderedDict()  # (scope, kind) -> {"entries": OrderedDict(id -> entry), "bands": {...}}
+        self._lock = threading.Lock()
+        self._rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+    def _bands(self, signature):
+        return [(i, signature[i * self._rows:(i + 1) * self._rows]) for i in range(MINHASH_BANDS)]
+
+    def find(self, scope, kind, text):
+        """(similarity, entry) of the closest earlier idea at or above the threshold, else None."""
+        shingles = idea_shingles(text)
+        if not shingles:
+            return None
+        bands = self._bands(minhash_signature(shingles))
+        with self._lock:
+            index = self._scopes.get((scope, kind))
+            if index is None:
+                return None
+            self._scopes.move_to_end((scope, kind))
+            candidates = set()
+            for band in bands:
+                candidates.update(index["bands"].get(band, ()))
+            best = None
+            for entry_id in candidates:
+                entry = index["entries"][entry_id]
+                similarity = jaccard(shingles, entry["shingles"])
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, entry)
+            return best
+
+    def add(self, scope, kind, text, result):
+        shingles = idea_shingles(text)
+        if not shingles:
+            return
+        entry = {"id": uuid.uuid4().hex, "text": text, "shingles": shingles, "result": result,
+                 "bands": self._bands(minhash_signature(shingles)), "createdAt": datetime.utcnow().isoformat()}
+        with self._lock:
+            index = self._scopes.get((scope, kind))
+            if index is None:
+                index = self._scopes[(scope, kind)] = {"entries": OrderedDict(), "bands": {}}
+                if len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end((scope, kind))
+            index["entries"][entry["id"]] = entry
+            for band in entry["bands"]:
+                index["bands"].setdefault(band, set()).add(entry["id"])
+            if len(index["entries"]) > self.max_per_scope:
+                _, old = index["entries"].popitem(last=False)
+                for band in old["bands"]:
+                    ids = index["bands"][band]
+                    ids.discard(old["id"])
+                    if not ids:
+                        del index["bands"][band]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(index["entries"]) for index in self._scopes.values())
+
+
+idea_index = NearDuplicateIndex(IDEA_DEDUP_THRESHOLD, IDEA_DEDUP_MAX_PER_PROJECT, IDEA_DEDUP_MAX_PROJECTS)
+
+
+def _idea_diff(old_text, new_text):
+    """Line-level changes between two idea texts, for a revision prompt."""
+    old_lines = [l for l in old_text.splitlines() if l.strip()]
+    new_lines = [l for l in new_text.splitlines() if l.strip()]
+    removed = [f"- {l}" for l in old_lines if l not in new_lines]
+    added = [f"+ {l}" for l in new_lines if l not in old_lines]
+    return "\n".join(removed + added) or "(only wording changed)"
+
+
+def near_duplicate_output(data, kind, idea_text):
+    """
+    Look idea_text up in the project's index. Returns (output, prompt, info):
+    output is an earlier result to reuse (else None), prompt a revision prompt to send
+    instead of the full one (else None), and info what to report as `nearDuplicate`.
+    """
+    mode = data.get("onDuplicate", "reuse")
+    if IDEA_DEDUP_THRESHOLD <= 0 or mode == "regenerate" or _cache_bypass_requested():
+        return None, None, None
+    scope = data.get("projectID") or request.user["uid"]
+    match = idea_index.find(scope, kind, idea_text)
+    metrics.inc("lpai_idea_dedup_total", {"kind": kind, "outcome": "hit" if match else "miss"})
+    if match is None:
+        return None, None, None
+    similarity, entry = match
+    info = {"similarity": round(similarity, 3), "matchedAt": entry["createdAt"], "mode": mode}
+    if mode == "revise":
+        prompt = (
+            "Below is an analysis written for a startup idea, followed by small changes to that idea. "
+            "Return the full analysis updated for the changes, keeping the same structure and "
+            "leaving unaffected sections as they are.\n\n"
+            f"Changes to the idea:\n{_idea_diff(entry['text'], idea_text)}\n\n"
+            f"Previous analysis:\n{entry['result']}"
+        )
+        return None, prompt, info
+    return entry["result"], None, info
+
+
+def _idea_input_text(input_data, fields):
+    """Idea fields as one line each; list items are sorted so reordering is not a change."""
+    lines = []
+    for field in fields:
+        value = input_data.get(field)
+        if value:
+            items = sorted(str(v) for v in value) if isinstance(value, list) else [str(value)]
+            lines.extend(f"{field}: {item}" for item in items)
+    return "\n".join(lines)
+
+
+def remember_idea_output(data, kind, idea_text, output):
+    if IDEA_DEDUP_THRESHOLD > 0 and output:
+        idea_index.add(data.get("projectID") or request.user["uid"], kind, idea_text, output)
+
+# ------------------- Graceful Shutdown -------------------
+# The production server (gunicorn.conf.py) calls begin_drain() when a worker receives
+# SIGTERM and drain() once its in-flight requests have finished. Async jobs (queued or
+# running) and pool refreshes get until the drain deadline to finish their Gemini calls;
+# new jobs are refused with 503. Buffered output writes are flushed last.
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "60"))
+draining = threading.Event()
+_drain_deadline = None
+
+
+class BackgroundWork:
+    """Counts background tasks (async jobs, pool refreshes) so shutdown can wait for them."""
+
+    def __init__(self):
+        self.pending = 0
+        self._cond = threading.Condition()
+
+    def start(self):
+        with self._cond:
+            self.pending += 1
+
+    def done(self):
+        with self._cond:
+            self.pending -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def track(self):
+        self.start()
+        try:
+            yield
+        finally:
+            self.done()
+
+    def wait_idle(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.pending == 0, timeout)
+
+
+background_work = BackgroundWork()
+
+
+def begin_drain(timeout=DRAIN_TIMEOUT_SECONDS):
+    """Stop taking background work; drain() waits at most until now + timeout."""
+    global _drain_deadline
+    if _drain_deadline is None:
+        _drain_deadline = time.monotonic() + timeout
+    draining.set()
+
+
+def drain(timeout=DRAIN_TIMEOUT_SECONDS):
+    """Wait for background Gemini work, then flush buffered writes. Returns False on timeout."""
+    begin_drain(timeout)
+    idle = background_work.wait_idle(max(0.0, _drain_deadline - time.monotonic()))
+    if not idle:
+        print(f"Drain timed out with {background_work.pending} background tasks pending")
+    if output_buffer:
+        output_buffer.flush_all()
+    job_executor.shutdown(wait=False, cancel_futures=True)
+    return idle
+
+# ------------------- Response Serialization & Compression -------------------
+# JSON bodies are encoded with orjson when it is installed (JSON_SERIALIZER=stdlib keeps
+# Flask's encoder). Output stays compact with sorted keys, and the types orjson does not
+# handle the way Flask does (datetimes, Decimal, ...) go through Flask's own conversion.
+# Bodies of at least COMPRESS_MIN_BYTES are brotli- or gzip-encoded as negotiated by
+# Accept-Encoding; brotli is only offered when the `brotli` package is installed.
+# Streamed (SSE) responses are passed through untouched.
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "auto")  # auto | orjson | stdlib
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # 0 disables compression
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "4"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html"}
+_brotli = None
+metrics.describe("lpai_response_bytes_total", "counter", "Compressed response bytes by encoding, before (raw) and after (wire).")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, producing the same compact, key-sorted JSON as the default."""
+
+    def __init__(self, app, orjson):
+        super().__init__(app)
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def _encode(self, obj):
+        options = self._options | (self._orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            return self._orjson.dumps(obj, default=self.default, option=options)
+        except TypeError:
+            # integers beyond 64 bits and the like; the stdlib raises for what is really unserializable
+            return json.dumps(obj, default=self.default, sort_keys=self.sort_keys, separators=(",", ":")).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj) + b"\n", mimetype=self.mimetype)
+
+
+def json_provider(app):
+    if JSON_SERIALIZER != "stdlib":
+        try:
+            import orjson
+            return OrjsonProvider(app, orjson)
+        except ImportError:
+            if JSON_SERIALIZER == "orjson":
+                raise
+    return DefaultJSONProvider(app)
+
+
+def _brotli_module():
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return _brotli_module().compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    # mtime=0 keeps the bytes (and so ETags computed over them) deterministic
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+@api.after_app_request
+def _compress_response(resp):
+    if (COMPRESS_MIN_BYTES <= 0 or resp.direct_passthrough or resp.is_streamed
+            or resp.status_code < 200 or resp.status_code in (204, 206, 304)
+            or "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return resp
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if _brotli_module() else ["gzip"])
+    if not encoding:
+        return resp
+    with span("compress"):
+        data = compress_body(body, encoding)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        # the encoded bytes differ from the identity body the strong ETag was computed over
+        resp.set_etag(etag, weak=True)
+    metrics.inc("lpai_response_bytes_total", {"encoding": encoding, "stage": "raw"}, len(body))
+    metrics.inc("lpai_response_bytes_total", {"encoding": encoding, "stage": "wire"}, len(data))
+    return resp
+
+# ------------------- Error Handlers -------------------
+@api.app_errorhandler(LLMError)
+def handle_llm_error(e):
+    resp = jsonify({"error": str(e)})
+    resp.status_code = e.status
+    if e.retry_after is not None:
+        resp.headers["Retry-After"] = str(max(1, int(round(e.retry_after))))
+    return resp
+
+@api.app_errorhandler(NotFoundError)
+def handle_not_found(e):
+    return jsonify({"error": str(e)}), 404
+
+# ------------------- METRICS ROUTE -------------------
+@api.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of request/span histograms, LLM usage and cache counters."""
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    lines = [metrics.render()]
+    gauges = {
+        "lpai_llm_cache": llm_cache.stats(),
+        "lpai_token_cache": token_cache_stats(),
+        "lpai_project_cache": project_cache.stats() if project_cache else {},
+    }
+    for controller in admission.values():
+        gauges[f"lpai_admission_{controller.name}"] = controller.stats()
+    for prefix, stats in gauges.items():
+        for key, value in stats.items():
+            name = prefix + "_" + re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+            if isinstance(value, dict):
+                for label, v in value.items():
+                    lines.append(f'{name}{{tier="{label}"}} {v}\n')
+            else:
+                lines.append(f"{name} {value}\n")
+    return Response("".join(lines), mimetype="text/plain; version=0.0.4")
 
 # ------------------- USER ROUTES -------------------
-@app.route("/user/signup", methods=["POST"])
+@api.route("/user/signup", methods=["POST"])
 def signup():
     """
     Creates Firebase Auth user using Admin SDK and a Firestore user doc.
@@ -118,29 +2955,116 @@ def signup():
     """
     data = request.json or {}
     try:
-        user = auth.create_user(email=data["email"], password=data["password"], display_name=data.get("name", ""))
-        db.collection("users").document(user.uid).set({
-            "userID": user.uid,
-            "name": data.get("name", ""),
-            "email": data["email"],
-            "projects": []
-        })
-        return jsonify({"message": "User created", "userID": user.uid}), 201
+        uid = user_store.create_account(data["email"], data["password"], data.get("name", ""))
+        return jsonify({"message": "User created", "userID": uid}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-@app.route("/user/<userID>", methods=["GET"])
+@api.route("/user/<userID>", methods=["GET"])
 @verify_firebase_token
 def get_user(userID):
     """Return user profile document (Firestore)."""
-    user_doc = db.collection("users").document(userID).get()
-    if user_doc.exists:
-        return jsonify(user_doc.to_dict())
+    user = user_store.get(userID)
+    if user is not None:
+        return jsonify(user)
     else:
         return jsonify({"error": "User not found"}), 404
 
+# Bulk export/import: NDJSON, one project per line in the shape of GET /project/<projectID>
+# (savedOutputs holds saved outputs and notes). Both directions work a chunk at a time, so
+# memory stays flat however many projects a user has.
+IMPORT_BATCH_WRITES = 500  # Firestore's limit on operations per batched write
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def _export_lines(project_ids):
+    dumps = current_app.json.dumps
+    for i in range(0, len(project_ids), PROJECT_BATCH_SIZE):
+        chunk = project_ids[i:i + PROJECT_BATCH_SIZE]
+        docs = bulk_project_store.get_many(chunk)
+        saved = bulk_project_store.saved_items_many([pid for pid in chunk if pid in docs])
+        for pid in chunk:
+            doc = docs.get(pid)
+            if doc is None:
+                continue
+            doc.pop(CONTEXT_SUMMARY, None)
+            doc["savedOutputs"] = _merge_saved_items(doc.get("savedOutputs"), saved[pid])
+            yield dumps(doc) + "\n"
+
+
+def _import_project(doc):
+    """Split one exported project into (fields, saved output docs, note docs)."""
+    fields = {k: v for k, v in doc.items() if k not in ("projectID", "savedOutputs", CONTEXT_SUMMARY)}
+    fields[CONTEXT_SUMMARY] = {c: summarize_output(o) for c, o in (fields.get("lastOutputs") or {}).items()}
+    items = [item if isinstance(item, dict) else {"content": item} for item in doc.get("savedOutputs") or []]
+    notes = [item for item in items if item.get("noteID")]
+    saved_docs = [item for item in items if not item.get("noteID")]
+    return fields, saved_docs, notes
+
+
+@api.route("/user/<userID>/export", methods=["GET"])
+@verify_firebase_token
+def export_user_projects(userID):
+    """Stream all of the user's projects as NDJSON (see above)."""
+    if request.user["uid"] != userID:
+        return jsonify({"error": "Forbidden"}), 403
+    user = user_store.get(userID)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    project_ids = list(dict.fromkeys(user.get("projects", [])))
+    return Response(stream_with_context(_export_lines(project_ids)), mimetype=NDJSON_MIMETYPE,
+                    headers={"Content-Disposition": f'attachment; filename="projects-{userID}.ndjson"'})
+
+
+@api.route("/user/<userID>/import", methods=["POST"])
+@verify_firebase_token
+def import_user_projects(userID):
+    """
+    Create projects from an NDJSON export in the request body and add them to the user.
+    Projects get new IDs; projectIDs maps each line's old projectID to its new one.
+    Lines are committed in batches of IMPORT_BATCH_WRITES writes while the body is read,
+    so on a malformed line (400) the projects before it stay imported.
+    """
+    if request.user["uid"] != userID:
+        return jsonify({"error": "Forbidden"}), 403
+    if user_store.get(userID) is None:
+        return jsonify({"error": "User not found"}), 404
+    imported = {}
+    pending, keys, writes = [], [], 0
+
+    def flush():
+        project_ids = bulk_project_store.import_projects(pending, IMPORT_BATCH_WRITES)
+        user_store.add_projects(userID, project_ids)
+        imported.update(zip(keys, project_ids))
+        pending.clear()
+        keys.clear()
+
+    # request.stream is unbuffered: iterating it directly reads lines a byte at a time
+    for lineno, line in enumerate(io.BufferedReader(request.stream, 1 << 16), 1):
+        if not line.strip():
+            continue
+        try:
+            doc = current_app.json.loads(line)
+            if not isinstance(doc, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            if pending:
+                flush()
+            return jsonify({"error": f"line {lineno}: {e}", "imported": len(imported), "projectIDs": imported}), 400
+        project = _import_project(doc)
+        ops = 1 + len(project[1]) + len(project[2])
+        if pending and writes + ops > IMPORT_BATCH_WRITES:
+            flush()
+            writes = 0
+        pending.append(project)
+        keys.append(str(doc.get("projectID") or f"line {lineno}"))
+        writes += ops
+    if pending:
+        flush()
+    return jsonify({"message": "Projects imported", "imported": len(imported), "projectIDs": imported}), 201
+
 # ------------------- PROJECT ROUTES -------------------
-@app.route("/project/create", methods=["POST"])
+@api.route("/project/create", methods=["POST"])
 @verify_firebase_token
 def create_project():
     """
@@ -148,89 +3072,112 @@ def create_project():
     Body: { "projectName": "..." }
     """
     data = request.json or {}
-    project_ref = db.collection("projects").document()
     project_obj = {
-        "projectID": project_ref.id,
         "projectName": data.get("projectName", "Untitled Project"),
         "status": data.get("status", "new"),
         "timeline": data.get("timeline", ""),
         "dashboard": data.get("dashboard", {}),
         "assistantsUsed": [],
         "lastOutputs": {},
-        "savedOutputs": [],
         # helpful fields for dashboard/progress
         "milestones": [],
         "achievements": []
     }
-    project_ref.set(project_obj)
+    projectID = project_store.create(project_obj)
     # Add to user projects list
-    user_ref = db.collection("users").document(request.user["uid"])
-    user_ref.update({"projects": firestore.ArrayUnion([project_ref.id])})
-    return jsonify({"message": "Project created", "projectID": project_ref.id}), 201
+    user_store.add_project(request.user["uid"], projectID)
+    return jsonify({"message": "Project created", "projectID": projectID}), 201
 
-@app.route("/project/<projectID>", methods=["GET"])
+@api.route("/project/<projectID>", methods=["GET"])
 @verify_firebase_token
 def get_project(projectID):
-    doc = db.collection("projects").document(projectID).get()
-    if doc.exists:
-        return jsonify(doc.to_dict())
+    data = project_store.get(projectID)
+    if data is not None:
+        data.pop(CONTEXT_SUMMARY, None)  # internal prompt context
+        data["savedOutputs"] = _merge_saved_items(data.get("savedOutputs"), project_store.saved_items(projectID))
+        return jsonify(data)
     return jsonify({"error": "Project not found"}), 404
 
-@app.route("/project/<projectID>/update", methods=["PUT"])
+@api.route("/project/<projectID>/update", methods=["PUT"])
 @verify_firebase_token
 def update_project(projectID):
     data = request.json or {}
-    db.collection("projects").document(projectID).update(data)
+    project_store.update(projectID, data)
     return jsonify({"message": "Project updated"}), 200
 
-@app.route("/project/<projectID>/delete", methods=["DELETE"])
+@api.route("/project/<projectID>/delete", methods=["DELETE"])
 @verify_firebase_token
 def delete_project(projectID):
-    # Remove project doc and remove from user's 'projects' array if exists
-    proj_ref = db.collection("projects").document(projectID)
-    proj_ref.delete()
+    # Remove project doc (and its saved outputs / notes) and remove from user's 'projects' array if exists
+    project_store.delete(projectID)
     # attempt to remove from current user's list (safe no-op if not present)
-    user_ref = db.collection("users").document(request.user["uid"])
-    user_ref.update({"projects": firestore.ArrayRemove([projectID])})
+    user_store.remove_project(request.user["uid"], projectID)
     return jsonify({"message": "Project deleted"}), 200
 
 # ------------------- DASHBOARD ROUTES -------------------
-@app.route("/dashboard/viewProjects", methods=["GET"])
+# fields the dashboard list needs; savedOutputs is opt-in because it grows without bound
+DASHBOARD_FIELDS = ["projectID", "projectName", "status", "timeline", "lastOutputs"]
+DASHBOARD_MAX_PAGE_SIZE = 100  # larger limits are clamped to this
+
+@api.route("/dashboard/viewProjects", methods=["GET"])
 @verify_firebase_token
 def dashboard_view_projects():
     """
-    Returns all projects for the authenticated user (reads user doc -> project IDs -> fetches docs)
+    Returns all projects for the authenticated user (reads user doc -> project IDs -> batched fetch)
+    Query params (all optional):
+      limit   -- page size (positive int, at most DASHBOARD_MAX_PAGE_SIZE); when set the response
+                 includes nextCursor (null on the last page)
+      cursor  -- nextCursor from the previous page
+      include -- "savedOutputs" to also return each project's saved outputs
+    Supports If-None-Match: an unchanged listing returns 304 with no body.
     """
-    user_doc = db.collection("users").document(request.user["uid"]).get()
-    if not user_doc.exists:
+    user = user_store.get(request.user["uid"])
+    if user is None:
         return jsonify({"error": "User not found"}), 404
-    projects = user_doc.to_dict().get("projects", [])
-    result = []
-    for pid in projects:
-        pdoc = db.collection("projects").document(pid).get()
-        if pdoc.exists:
-            d = pdoc.to_dict()
-            # minimal fields to populate dashboard
-            result.append({
-                "projectID": d.get("projectID"),
-                "projectName": d.get("projectName"),
-                "status": d.get("status"),
-                "timeline": d.get("timeline"),
-                "lastOutputs": d.get("lastOutputs"),
-                "savedOutputs": d.get("savedOutputs")
-            })
-    return jsonify({"projects": result})
-
-@app.route("/dashboard/<projectID>/trackProgress", methods=["GET"])
+    projects = user.get("projects", [])
+
+    start = 0
+    cursor = request.args.get("cursor")
+    if cursor:
+        if cursor not in projects:
+            return jsonify({"error": "Invalid cursor"}), 400
+        start = projects.index(cursor) + 1
+    limit = None
+    if "limit" in request.args:
+        limit = request.args.get("limit", type=int)
+        if limit is None or limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, DASHBOARD_MAX_PAGE_SIZE)
+    page = projects[start:start + limit] if limit else projects[start:]
+
+    include_saved = "savedOutputs" in request.args.get("include", "").split(",")
+    # savedOutputs in the projection only picks up legacy (unmigrated) arrays
+    docs = project_store.get_many(page, DASHBOARD_FIELDS + (["savedOutputs"] if include_saved else []))
+    # keep the user's project order; minimal fields to populate dashboard
+    # keyed by document id: legacy docs may lack a projectID field
+    found = [pid for pid in page if pid in docs]
+    result = [{f: docs[pid].get(f) for f in DASHBOARD_FIELDS} for pid in found]
+    if include_saved:
+        saved = project_store.saved_items_many(found)
+        for pid, p in zip(found, result):
+            p["savedOutputs"] = _merge_saved_items(docs[pid].get("savedOutputs"), saved[pid])
+
+    body = {"projects": result}
+    if limit:
+        body["nextCursor"] = page[-1] if page and start + limit < len(projects) else None
+    resp = jsonify(body)
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+@api.route("/dashboard/<projectID>/trackProgress", methods=["GET"])
 @verify_firebase_token
 def dashboard_track_progress(projectID):
     """
     Returns progress-specific fields (timeline, milestones, achievements) from project.
     """
-    d = db.collection("projects").document(projectID).get()
-    if not d.exists:
+    data = project_store.get(projectID, ["timeline", "milestones", "achievements", "lastOutputs"])
+    if data is None:
         return jsonify({"error": "Project not found"}), 404
-    data = d.to_dict()
     progress = {
         "timeline": data.get("timeline"),
         "milestones": data.get("milestones", []),
@@ -239,90 +3186,173 @@ def dashboard_track_progress(projectID):
     }
     return jsonify(progress)
 
-# ------------------- BRANDING ASSISTANT -------------------
-@app.route("/assistant/branding/generateName", methods=["POST"])
+# ------------------- JOB ROUTES -------------------
+@api.route("/jobs/<jobID>", methods=["GET"])
 @verify_firebase_token
-def branding_generate_name():
-    data = request.json or {}
-    prompt = (
+def get_job(jobID):
+    """
+    Status of a background job started with `async: true`.
+    status: queued | running | succeeded | failed; result holds the route's usual JSON body.
+    """
+    job = job_store.get(jobID)
+    if not job or job["owner"] != request.user["uid"]:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({k: v for k, v in job.items() if k != "owner" and not k.startswith("_")})
+
+# ------------------- BRANDING ASSISTANT -------------------
+def _branding_names_prompt(data):
+    return (
         f"Suggest 10 creative, unique, and brandable startup names for the idea:\n\n{data.get('idea','')}\n\n"
         "Give short 1–2 word names, followed by a one-line reason for each."
     )
-    output = call_gemini(prompt)
+
+def _branding_tagline_prompt(data):
+    return (
+        f"Generate 5 catchy, professional taglines for this startup idea:\n\n{data.get('idea','')}\n\n"
+        "Keep them short (6-10 words) and highlight the value proposition."
+    )
+
+def _branding_content_prompt(data):
+    return (
+        f"Write a short marketing paragraph (approx 80-120 words) for the startup idea:\n\n{data.get('idea','')}\n\n"
+        "Tone: professional and friendly. Include target audience and one call-to-action."
+    )
+
+def _branding_colors_prompt(data):
+    style = data.get("style", "modern and trustworthy")
+    return (
+        f"Based on this startup idea:\n\n{data.get('idea','')}\n\n"
+        f"Suggest a 4-color palette with HEX codes and brief usage notes (primary, secondary, accent, neutral). Style: {style}."
+    )
+
+# batch task name -> (response key, prompt builder); order matches the single-task routes
+BRANDING_TASKS = {
+    "names": ("brandingNames", _branding_names_prompt),
+    "taglines": ("taglines", _branding_tagline_prompt),
+    "content": ("content", _branding_content_prompt),
+    "colors": ("colors", _branding_colors_prompt),
+}
+# branding_batch's calls run here; sized so concurrent batches don't wait on each other
+llm_fanout_executor = ThreadPoolExecutor(
+    max_workers=_fanout_workers("LLM_FANOUT_WORKERS", len(BRANDING_TASKS)), thread_name_prefix="lpai-llm"
+)
+
+@api.route("/assistant/branding/generateName", methods=["POST"])
+@verify_firebase_token
+@async_job
+def branding_generate_name():
+    data = request.json or {}
+    output = call_gemini(_branding_names_prompt(data), category="branding")
     _update_project_output(data["projectID"], "branding", output, data.get("save", False))
     return jsonify({"brandingNames": output})
 
-@app.route("/assistant/branding/createTagline", methods=["POST"])
+@api.route("/assistant/branding/createTagline", methods=["POST"])
 @verify_firebase_token
+@async_job
 def branding_tagline():
     data = request.json or {}
-    prompt = (
-        f"Generate 5 catchy, professional taglines for this startup idea:\n\n{data.get('idea','')}\n\n"
-        "Keep them short (6-10 words) and highlight the value proposition."
-    )
-    output = call_gemini(prompt)
+    output = call_gemini(_branding_tagline_prompt(data), category="branding")
     _update_project_output(data["projectID"], "branding", output, data.get("save", False))
     return jsonify({"taglines": output})
 
-@app.route("/assistant/branding/generateContent", methods=["POST"])
+@api.route("/assistant/branding/generateContent", methods=["POST"])
 @verify_firebase_token
+@async_job
 def branding_content():
     data = request.json or {}
-    prompt = (
-        f"Write a short marketing paragraph (approx 80-120 words) for the startup idea:\n\n{data.get('idea','')}\n\n"
-        "Tone: professional and friendly. Include target audience and one call-to-action."
-    )
-    output = call_gemini(prompt)
+    output = call_gemini(_branding_content_prompt(data), category="branding")
     _update_project_output(data["projectID"], "branding", output, data.get("save", False))
     return jsonify({"content": output})
 
-@app.route("/assistant/branding/suggestColors", methods=["POST"])
+@api.route("/assistant/branding/suggestColors", methods=["POST"])
 @verify_firebase_token
+@async_job
 def branding_suggest_colors():
     """
     Suggest color palette (hex codes + usage). Body: { idea, style(optional), projectID, save(optional) }
     """
     data = request.json or {}
-    style = data.get("style", "modern and trustworthy")
-    prompt = (
-        f"Based on this startup idea:\n\n{data.get('idea','')}\n\n"
-        f"Suggest a 4-color palette with HEX codes and brief usage notes (primary, secondary, accent, neutral). Style: {style}."
-    )
-    output = call_gemini(prompt)
+    output = call_gemini(_branding_colors_prompt(data), category="branding")
     _update_project_output(data["projectID"], "branding", output, data.get("save", False))
     return jsonify({"colors": output})
 
+@api.route("/assistant/branding/batch", methods=["POST"])
+@verify_firebase_token
+@async_job
+def branding_batch():
+    """
+    Run several branding tasks for one idea concurrently and persist them in one write.
+    Body: { projectID, idea, style(optional), tasks(optional: list of names|taglines|content|colors, or one
+          of them; default all), save(optional) }
+    Returns the same keys as the single-task routes (brandingNames, taglines, content, colors).
+    """
+    data = request.json or {}
+    projectID = data.get("projectID")
+    if not projectID:
+        return jsonify({"error": "projectID required"}), 400
+    tasks = data.get("tasks") or list(BRANDING_TASKS)
+    if isinstance(tasks, str):
+        tasks = [tasks]
+    if not isinstance(tasks, list) or not all(isinstance(t, str) for t in tasks):
+        return jsonify({"error": "tasks must be a list of task names", "allowed": list(BRANDING_TASKS)}), 400
+    unknown = [t for t in tasks if t not in BRANDING_TASKS]
+    if unknown:
+        return jsonify({"error": f"Unknown branding tasks: {unknown}", "allowed": list(BRANDING_TASKS)}), 400
+
+    # worker threads have no request context, so resolve the cache bypass flag here
+    use_cache = not _cache_bypass_requested()
+    futures = [
+        llm_fanout_executor.submit(call_gemini, BRANDING_TASKS[t][1](data), category="branding", use_cache=use_cache)
+        for t in tasks
+    ]
+    outputs = [f.result() for f in futures]
+
+    try:
+        _update_project_outputs(projectID, "branding", outputs, data.get("save", False))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({BRANDING_TASKS[t][0]: output for t, output in zip(tasks, outputs)})
+
 # ------------------- LEGAL ASSISTANT -------------------
-@app.route("/assistant/legal/simplifyDocument", methods=["POST"])
+@api.route("/assistant/legal/simplifyDocument", methods=["POST"])
 @verify_firebase_token
+@async_job
 def legal_simplify():
     data = request.json or {}
     prompt = f"Simplify the following legal text into plain English while preserving legal meaning:\n\n{data.get('text','')}"
-    output = call_gemini(prompt)
+    output = call_gemini(prompt, category="legal")
     _update_project_output(data["projectID"], "legal", output, data.get("save", False))
     return jsonify({"simplifiedDoc": output})
 
-@app.route("/assistant/legal/suggestStructure", methods=["POST"])
+@api.route("/assistant/legal/suggestStructure", methods=["POST"])
 @verify_firebase_token
+@async_job
 def legal_structure():
     data = request.json or {}
     prompt = (
         f"Suggest the most suitable business legal structures (e.g., LLC, Pvt Ltd, Partnership) for the startup idea:\n\n"
         f"{data.get('idea','')}\n\nList pros/cons and recommended next steps for each structure."
     )
-    output = call_gemini(prompt)
+    output = call_gemini(prompt, category="legal")
     _update_project_output(data["projectID"], "legal", output, data.get("save", False))
     return jsonify({"legalStructure": output})
 
 # ------------------- MOTIVATION HUB -------------------
-@app.route("/assistant/motivation/showEncouragement", methods=["GET"])
+# Fixed prompts, served from pre-generated pools (see VariantPool)
+ENCOURAGEMENT_PROMPT = "Give motivational advice and a short daily routine for a solo founder struggling to stay consistent."
+SUCCESS_STORIES_PROMPT = "Write three short startup success stories (150-250 words each) about small teams that made a product-market fit and grew sustainably."
+encouragement_pool = VariantPool("encouragement", ENCOURAGEMENT_PROMPT, "motivation", "motivation_encouragement")
+success_stories_pool = VariantPool("success_stories", SUCCESS_STORIES_PROMPT, "motivation", "motivation_success_stories")
+variant_pools.extend([encouragement_pool, success_stories_pool])
+
+@api.route("/assistant/motivation/showEncouragement", methods=["GET"])
 @verify_firebase_token
+@async_job
 def motivation_encouragement():
-    prompt = "Give motivational advice and a short daily routine for a solo founder struggling to stay consistent."
-    output = call_gemini(prompt)
+    output = pregenerated(encouragement_pool, request.user["uid"])
     return jsonify({"encouragement": output})
 
-@app.route("/assistant/motivation/trackMilestone", methods=["POST"])
+@api.route("/assistant/motivation/trackMilestone", methods=["POST"])
 @verify_firebase_token
 def motivation_track_milestone():
     """
@@ -341,10 +3371,10 @@ def motivation_track_milestone():
         "notes": data.get("notes", ""),
         "createdBy": request.user["uid"]
     }
-    db.collection("projects").document(projectID).update({"milestones": firestore.ArrayUnion([milestone])})
+    project_store.append(projectID, "milestones", [milestone])
     return jsonify({"message": "Milestone tracked", "milestone": milestone}), 201
 
-@app.route("/assistant/motivation/achievement", methods=["POST"])
+@api.route("/assistant/motivation/achievement", methods=["POST"])
 @verify_firebase_token
 def motivation_achievement():
     """
@@ -362,57 +3392,66 @@ def motivation_achievement():
         "createdBy": request.user["uid"]
     }
     # store in project's achievements
-    db.collection("projects").document(projectID).update({"achievements": firestore.ArrayUnion([achievement])})
+    project_store.append(projectID, "achievements", [achievement])
 
-    response_text = ""
+    result = {"message": "Achievement recorded", "achievement": achievement, "celebration": ""}
     if data.get("celebrate", False):
         prompt = f"Write a short celebratory message for this achievement:\n\n{data['achievementText']}\n\nKeep it upbeat and <50 words."
-        response_text = call_gemini(prompt)
+        try:
+            result["celebration"] = call_gemini(prompt, category="motivation")
+        except LLMError as e:
+            # the achievement is already recorded; report the missing celebration instead of failing
+            result["celebrationError"] = str(e)
+            return jsonify(result)
         # if requested, save the celebration text to savedOutputs
         if data.get("save", False):
-            db.collection("projects").document(projectID).update({
-                "savedOutputs": firestore.ArrayUnion([
-                    {
-                        "type": "achievement_celebration",
-                        "content": response_text,
-                        "savedAt": datetime.utcnow().isoformat()
-                    }
-                ])
-            })
+            project_store.add_saved_output(
+                projectID,
+                _saved_output_doc(projectID, "achievement_celebration", result["celebration"], datetime.utcnow().isoformat())
+            )
 
-    return jsonify({"message": "Achievement recorded", "achievement": achievement, "celebration": response_text})
+    return jsonify(result)
 
-@app.route("/assistant/motivation/successStories", methods=["GET"])
+@api.route("/assistant/motivation/successStories", methods=["GET"])
 @verify_firebase_token
+@async_job
 def motivation_success_stories():
     """
     Generate or fetch success stories for inspiration.
-    Query params: projectID (optional)
+    Query params: projectID (optional), stream (optional, "true" for Server-Sent Events)
     If projectID provided, uses project's savedOutputs + achievements to craft a short success story.
     """
     projectID = request.args.get("projectID")
-    if projectID:
-        pdoc = db.collection("projects").document(projectID).get()
-        if not pdoc.exists:
-            return jsonify({"error": "Project not found"}), 404
-        pdata = pdoc.to_dict()
-        # build prompt with key fields
-        prompt = (
-            "Using the following project data, write a short success-story-style summary (200-300 words) that a founder can read for motivation:\n\n"
-            f"Project name: {pdata.get('projectName')}\n"
-            f"Achievements: {pdata.get('achievements', [])}\n"
-            f"Recent outputs: {pdata.get('lastOutputs', {})}\n\n"
-            "Make it inspiring and realistic."
-        )
-    else:
-        prompt = "Write three short startup success stories (150-250 words each) about small teams that made a product-market fit and grew sustainably."
+    if not projectID:
+        # generic stories: the prompt never changes, so they come from the pre-generated pool
+        stories = pregenerated(success_stories_pool, request.user["uid"])
+        if _stream_requested(None):
+            return stream_llm_response(None, "motivation", lambda output: {"successStories": output}, text=stories)
+        return jsonify({"successStories": stories})
+
+    pdata = project_store.get(projectID, ["projectName", "achievements", CONTEXT_SUMMARY])
+    if pdata is None:
+        return jsonify({"error": "Project not found"}), 404
+    if CONTEXT_SUMMARY not in pdata:
+        # summaries are written with outputs; older projects fall back to their full outputs
+        pdata["lastOutputs"] = (project_store.get(projectID, ["lastOutputs"]) or {}).get("lastOutputs", {})
+    # build prompt from compacted key fields, trimmed to PROMPT_TOKEN_BUDGET
+    prompt, _ = build_budgeted_prompt(
+        "Using the following project data, write a short success-story-style summary (200-300 words) that a founder can read for motivation:",
+        project_context_sections(pdata),
+        footer="Make it inspiring and realistic.",
+    )
+
+    if _stream_requested(None):
+        return stream_llm_response(prompt, "motivation", lambda output: {"successStories": output})
 
-    output = call_gemini(prompt)
+    output = call_gemini(prompt, category="motivation")
     return jsonify({"successStories": output})
 
 # ------------------- IDEATION SUITE -------------------
-@app.route("/assistant/ideation/generateIdea", methods=["POST"])
+@api.route("/assistant/ideation/generateIdea", methods=["POST"])
 @verify_firebase_token
+@async_job
 def ideation_generate():
     data = request.json or {}
     input_data = {}
@@ -443,6 +3482,7 @@ def ideation_generate():
             audience = input_data['Target Audience'] if isinstance(input_data['Target Audience'], list) else [input_data['Target Audience']]
             prompt += "Target Audience:\n" + "\n".join([f"- {a}" for a in audience]) + "\n\n"
         
+        idea_text = _idea_input_text(input_data, ("Name", "Feature", "Context", "Target Audience"))
         prompt += """
 Please provide a detailed analysis with the following structure:
 1. Business Summary: A clear, concise description of the business concept
@@ -456,36 +3496,211 @@ Provide the response in well-organized sections with headings.
 keep the content clear and consise and avoid jargons.
 leave a line after each section."""
 
-        output = call_gemini(prompt)
-        
-        # Create structured response
-        response = {
-            "generated": {
-                "name": input_data.get('Name', ['Unnamed Idea'])[0] if isinstance(input_data.get('Name'), list) else input_data.get('Name', 'Unnamed Idea'),
-                "description": output,
-                "analysis": {
-                    "createdAt": datetime.utcnow().isoformat(),
-                    "type": "generated"
+        reused, revise_prompt, duplicate = near_duplicate_output(data, "ideation", idea_text)
+
+        def finalize(output):
+            if reused is None:
+                remember_idea_output(data, "ideation", idea_text, output)
+            # Create structured response
+            response = {
+                "generated": {
+                    "name": input_data.get('Name', ['Unnamed Idea'])[0] if isinstance(input_data.get('Name'), list) else input_data.get('Name', 'Unnamed Idea'),
+                    "description": output,
+                    "analysis": {
+                        "createdAt": datetime.utcnow().isoformat(),
+                        "type": "generated"
+                    }
                 }
             }
-        }
 
+            if duplicate:
+                response["nearDuplicate"] = duplicate
+            # Save if requested
+            if data.get('save', False):
+                _update_project_output(data["projectID"], "ideation", response["generated"], True)
+            return response
+
+        prompt = revise_prompt or prompt
+        if _stream_requested(data):
+            return stream_llm_response(prompt, "ideation", finalize, text=reused)
+
+        output = reused if reused is not None else call_gemini(prompt, category="ideation")
+        return jsonify(finalize(output))
         
-        # Save if requested
-        if data.get('save', False):
-            _update_project_output(data["projectID"], "ideation", response["generated"], True)
-            
-        return jsonify(response)
-        
+    except LLMError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-@app.route("/assistant/ideation/validateIdea", methods=["POST"])
+# Sectioned validation (`sectioned: true`): each report section is its own prompt over the
+# same idea context, generated concurrently on validation_section_executor and merged in
+# order, so wall-clock is roughly the slowest section. `section: "<key>"` re-runs one section and
+# merges it into `report` (or the project's saved validation) when that one is sectioned.
+VALIDATION_SECTIONS = [
+    # key, heading, points to cover, score field (None if the section has no score)
+    ("market", "Market Analysis",
+     ["Market size and potential", "Current market trends", "Competition analysis", "Market entry barriers"], None),
+    ("businessModel", "Business Model Validation",
+     ["Revenue potential", "Cost structure analysis", "Scalability assessment"], "businessModelViability"),
+    ("technical", "Technical Feasibility",
+     ["Implementation complexity", "Resource requirements", "Technical risks"], "technologyReadiness"),
+    ("risk", "Risk Assessment",
+     ["Key business risks", "Mitigation strategies", "Critical success factors"], "overallRisk"),
+    ("recommendations", "Recommendations",
+     ["Key strengths to leverage", "Areas needing improvement", "Immediate next steps", "Long-term considerations"], None),
+]
+# its own pool, sized like the branding one, so sections of concurrent reports don't
+# queue behind each other or behind branding batches
+validation_section_executor = ThreadPoolExecutor(
+    max_workers=_fanout_workers("VALIDATION_SECTION_WORKERS", len(VALIDATION_SECTIONS)),
+    thread_name_prefix="lpai-section",
+)
+SCORE_LABELS = {
+    "businessModelViability": "business model viability",
+    "technologyReadiness": "technology readiness",
+    "overallRisk": "overall risk",
+}
+
+
+def _validation_section_prompt(idea, key):
+    number, (_, heading, points, score) = next((i + 1, sec) for i, sec in enumerate(VALIDATION_SECTIONS) if sec[0] == key)
+    prompt = f"""
+Analyze the following startup idea:
+
+Name: {idea.get('name', 'Unnamed Idea')}
+Description: {idea.get('description', 'No description provided')}
+
+Write only section {number} of its validation analysis, "{heading}", starting with the heading
+"{number}. {heading}" and covering:
+""" + "\n".join(f"   - {p}" for p in points) + """
+
+Provide clear, actionable insights and specific recommendations.
+"""
+    if score:
+        prompt += f"End with a final line of the form 'SCORE: <1-10>/10' giving the {SCORE_LABELS[score]} score.\n"
+    return prompt
+
+
+def _parse_score(text):
+    match = re.search(r"(\d+(?:\.\d+)?)", text)
+    if match and 1 <= float(match.group(1)) <= 10:
+        value = float(match.group(1))
+        return int(value) if value.is_integer() else value
+    return None
+
+
+def extract_validation_scores(report):
+    """The three 1-10 scores of a single-call validation report, by label (None if absent)."""
+    text = re.sub(r"\(\s*1\s*[-\u2013]\s*10\s*\)", "", report)
+    scores = {}
+    for field, label in SCORE_LABELS.items():
+        match = re.search(label + r" score\W{0,10}([^\n]{0,20})", text, re.IGNORECASE)
+        scores[field] = _parse_score(match.group(1)) if match else None
+    return scores
+
+
+_SECTION_SCORE_RE = re.compile(r"^[*_ \t]*SCORE[ \t]*:[ \t]*(\d+(?:\.\d+)?)[ \t]*(?:/[ \t]*10)?[*_. \t]*$",
+                               re.IGNORECASE | re.MULTILINE)
+
+
+def _split_section_score(text):
+    """(section text without its SCORE line, score or None)."""
+    # only the marker line the prompt asks for ("SCORE: 7/10", optionally bolded); the last one wins
+    matches = list(_SECTION_SCORE_RE.finditer(text))
+    if not matches:
+        return text.strip(), None
+    match = matches[-1]
+    return (text[:match.start()] + text[match.end():]).strip(), _parse_score(match.group(1))
+
+
+def _merge_sections(sections, scores):
+    parts = []
+    for key, _, _, score in VALIDATION_SECTIONS:
+        if key in sections:
+            parts.append(sections[key])
+            if score and scores.get(score) is not None:
+                parts.append(f"{SCORE_LABELS[score].capitalize()} score: {scores[score]}/10")
+    return "\n\n".join(parts)
+
+
+def _validate_sectioned(data, idea):
+    """sectioned / single-section validation; see VALIDATION_SECTIONS."""
+    keys = [sec[0] for sec in VALIDATION_SECTIONS]
+    only = data.get("section")
+    if only and only not in keys:
+        return jsonify({"error": f"unknown section {only!r}", "sections": keys}), 400
+    base = data.get("report")
+    if only and base is None and data.get("projectID"):
+        stored = project_store.get(data["projectID"], ["lastOutputs"]) or {}
+        base = (stored.get("lastOutputs") or {}).get("ideation_validation")
+    if only and not (isinstance(base, dict) and isinstance(base.get("sections"), dict)):
+        base = None  # nothing sectioned to merge into: return just the section
+    sections = dict(base["sections"]) if base else {}
+    scores = dict(base.get("scores") or {}) if base else {}
+    run = [only] if only else keys
+
+    use_cache = not _cache_bypass_requested()
+    futures = {
+        validation_section_executor.submit(call_gemini, _validation_section_prompt(idea, key),
+                                           category="ideation_validation", use_cache=use_cache,
+                                           route="ideation_validate"): key
+        for key in run
+    }
+    score_fields = {sec[0]: sec[3] for sec in VALIDATION_SECTIONS}
+
+    def collect(future):
+        key = futures[future]
+        text, score = _split_section_score(future.result())
+        sections[key] = text
+        if score_fields[key]:
+            scores[score_fields[key]] = score
+        return key
+
+    def result():
+        if only and base is None:
+            return {"section": only, "text": sections[only], "score": scores.get(score_fields[only])}
+        validation_result = {
+            "ideaName": idea.get('name', 'Unnamed Idea'),
+            "validationReport": _merge_sections(sections, scores),
+            "sections": sections,
+            "scores": {field: scores.get(field) for field in SCORE_LABELS},
+            "timestamp": datetime.utcnow().isoformat(),
+            "type": "validation",
+            "mode": "sectioned",
+        }
+        if data.get('save', False):
+            _update_project_output(data["projectID"], "ideation_validation", validation_result, True)
+        return {"validation": validation_result}
+
+    if not _stream_requested(data):
+        for future in list(futures):
+            collect(future)
+        return jsonify(result())
+
+    def events():
+        # sections are sent as they finish, then the merged report as `done`
+        try:
+            for future in as_completed(futures):
+                key = collect(future)
+                yield _sse("section", {"section": key, "text": sections[key], "score": scores.get(score_fields[key])})
+            yield _sse("done", result())
+        except Exception as e:
+            print("Streaming error:", e)
+            yield _sse("error", {"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@api.route("/assistant/ideation/validateIdea", methods=["POST"])
 @verify_firebase_token
+@async_job
 def ideation_validate():
     data = request.json or {}
     try:
         idea = json.loads(data['idea']) if isinstance(data.get('idea'), str) else data.get('idea', {})
+        if data.get("sectioned") or data.get("section"):
+            return _validate_sectioned(data, idea)
         
         prompt = f"""
 Analyze the following startup idea in detail:
@@ -527,28 +3742,149 @@ Please provide a comprehensive validation analysis with the following sections:
 
 For each section, provide clear, actionable insights and specific recommendations.
 """
-        
-        output = call_gemini(prompt)
-        
-        # Create structured response
-        validation_result = {
-            "ideaName": idea.get('name', 'Unnamed Idea'),
-            "validationReport": output,
-            "timestamp": datetime.utcnow().isoformat(),
-            "type": "validation"
-        }
+        idea_text = f"{idea.get('name', '')}\n{idea.get('description', '')}"
+        reused, revise_prompt, duplicate = near_duplicate_output(data, "ideation_validation", idea_text)
+
+        def finalize(output):
+            if reused is None:
+                remember_idea_output(data, "ideation_validation", idea_text, output)
+            # Create structured response
+            validation_result = {
+                "ideaName": idea.get('name', 'Unnamed Idea'),
+                "validationReport": output,
+                "scores": extract_validation_scores(output),
+                "timestamp": datetime.utcnow().isoformat(),
+                "type": "validation"
+            }
 
+            if data.get('save', False):
+                _update_project_output(data["projectID"], "ideation_validation", validation_result, True)
+            response = {"validation": validation_result}
+            if duplicate:
+                response["nearDuplicate"] = duplicate
+            return response
+
+        prompt = revise_prompt or prompt
+        if _stream_requested(data):
+            return stream_llm_response(prompt, "ideation_validation", finalize, text=reused)
+
+        output = reused if reused is not None else call_gemini(prompt, category="ideation_validation")
+        return jsonify(finalize(output))
         
-        if data.get('save', False):
-            _update_project_output(data["projectID"], "ideation_validation", validation_result, True)
-            
-        return jsonify({"validation": validation_result})
-        
+    except LLMError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-@app.route("/assistant/ideation/generateRoadmap", methods=["POST"])
+# Structured output: Gemini is constrained to this schema, and the result is still
+# validated (and repaired if needed) before it is stored as an object.
+ROADMAP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "timeframe": {"type": "string"},
+                },
+                "required": ["name", "description", "timeframe"],
+            },
+        },
+    },
+    "required": ["steps"],
+}
+ROADMAP_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": ROADMAP_SCHEMA}
+
+
+def _truncated_json_candidates(text):
+    """
+    Completions of a truncated JSON document, longest first: cut back to the end of a
+    complete value, then append the brackets that are still open at that point.
+    """
+    boundaries = []
+    closers = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+            boundaries.append((i + 1, "".join(reversed(closers))))
+        elif ch == ",":
+            boundaries.append((i, "".join(reversed(closers))))
+    for end, closing in reversed(boundaries[-50:]):
+        yield text[:end] + closing
+
+
+def _repair_json(text):
+    """
+    Parse model output as a JSON object or array, repairing the defects models commonly
+    produce: markdown fences, prose around the value, smart quotes, trailing commas and
+    truncation. Raises ValueError if it still does not parse.
+    """
+    stripped = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    if "{" not in stripped and "[" not in stripped:
+        raise ValueError("no JSON object in model output")
+    # smart quotes are only swapped if the text does not parse as-is
+    for candidate in (stripped, stripped.replace("\u201c", '"').replace("\u201d", '"')):
+        # the value starts at the first bracket; prose may contain one, so try both kinds
+        starts = sorted((candidate.find(opener), closer) for opener, closer in (("{", "}"), ("[", "]"))
+                        if opener in candidate)
+        for start, closer in starts:
+            end = candidate.rfind(closer)
+            candidates = [candidate[start:end + 1]] if end > start else []
+            candidates.extend(_truncated_json_candidates(candidate[start:]))
+            for c in candidates:
+                for attempt in (c, re.sub(r",\s*([}\]])", r"\1", c)):
+                    try:
+                        return json.loads(attempt)
+                    except ValueError:
+                        continue
+    raise ValueError("model output is not valid JSON")
+
+
+def _parse_roadmap(text):
+    """Parse and validate roadmap output into {"steps": [{name, description, timeframe}, ...]}."""
+    data = _repair_json(text)
+    steps = data.get("steps") if isinstance(data, dict) else data
+    if not isinstance(steps, list):
+        raise ValueError("roadmap has no steps array")
+    clean = []
+    for step in steps:
+        # a step missing a required field is usually the half-written tail of truncated output
+        if not isinstance(step, dict):
+            continue
+        step = {f: str(step.get(f) or "").strip() for f in ("name", "description", "timeframe")}
+        if all(step.values()):
+            clean.append(step)
+    if not clean:
+        raise ValueError("roadmap has no valid steps")
+    return {"steps": clean}
+
+
+def _is_valid_roadmap(text):
+    try:
+        _parse_roadmap(text)
+        return True
+    except ValueError:
+        return False
+
+
+@api.route("/assistant/ideation/generateRoadmap", methods=["POST"])
 @verify_firebase_token
+@async_job
 def ideation_generate_roadmap():
     data = request.json or {}
     try:
@@ -621,13 +3957,19 @@ Output must be strictly valid JSON in this structure:
 
 
         
-        output = call_gemini(prompt)
-        
+        output = call_gemini(prompt, category="ideation_roadmap",
+                             generation_config=ROADMAP_GENERATION_CONFIG, cache_if=_is_valid_roadmap)
+        try:
+            parsed = _parse_roadmap(output)
+        except ValueError as e:
+            print("Roadmap parse error:", e)
+            return jsonify({"error": f"Roadmap generation failed: {e}", "raw": output}), 502
+
         # Create structured response
         roadmap = {
             "ideas": [idea.get('name', 'Unnamed') for idea in ideas],
             "timeline": params.get('timeline'),
-            "roadmap": output,
+            "roadmap": parsed,
             "createdAt": datetime.utcnow().isoformat(),
             "type": "roadmap"
         }
@@ -638,38 +3980,46 @@ Output must be strictly valid JSON in this structure:
             
         return jsonify({"roadmap": roadmap})
         
+    except LLMError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 # ------------------- DIGITAL WHITEBOARD -------------------
-@app.route("/assistant/whiteboard/addNote", methods=["POST"])
+@api.route("/assistant/whiteboard/addNote", methods=["POST"])
 @verify_firebase_token
 def add_note():
     data = request.json or {}
     projectID = data.get("projectID")
     if not projectID:
         return jsonify({"error": "projectID required"}), 400
-    note = {"noteID": str(uuid.uuid4()), "text": data.get("text", ""), "createdBy": request.user["uid"]}
-    db.collection("projects").document(projectID).update({"savedOutputs": firestore.ArrayUnion([note])})
+    if not project_store.exists(projectID):
+        return jsonify({"error": "Project not found"}), 404
+    note = {"noteID": str(uuid.uuid4()), "text": data.get("text", ""), "createdBy": request.user["uid"],
+            "createdAt": datetime.utcnow().isoformat()}
+    project_store.add_note(projectID, note)
     return jsonify({"message": "Note added", "note": note}), 201
 
-@app.route("/assistant/whiteboard/editNote/<noteID>", methods=["PUT"])
+@api.route("/assistant/whiteboard/editNote/<noteID>", methods=["PUT"])
 @verify_firebase_token
 def edit_note(noteID):
     """
     Edit note content. Body: { projectID, text }
-    Implementation: fetch savedOutputs array, replace the object with matching noteID, update whole array.
+    Implementation: update the note's doc in the project's notes subcollection; notes of
+    unmigrated projects are edited in the legacy savedOutputs array.
     """
     data = request.json or {}
     projectID = data.get("projectID")
     new_text = data.get("text", "")
     if not projectID:
         return jsonify({"error": "projectID required"}), 400
-    proj_ref = db.collection("projects").document(projectID)
-    proj_doc = proj_ref.get()
-    if not proj_doc.exists:
+    if project_store.update_note(projectID, noteID, {"text": new_text, "editedAt": datetime.utcnow().isoformat()}):
+        return jsonify({"message": "Note updated", "noteID": noteID}), 200
+
+    proj = project_store.get(projectID, ["savedOutputs"])
+    if proj is None:
         return jsonify({"error": "Project not found"}), 404
-    saved = proj_doc.to_dict().get("savedOutputs", [])
+    saved = proj.get("savedOutputs", [])
     updated = []
     found = False
     for item in saved:
@@ -684,30 +4034,58 @@ def edit_note(noteID):
             updated.append(item)
     if not found:
         return jsonify({"error": "Note not found"}), 404
-    proj_ref.update({"savedOutputs": updated})
+    project_store.update(projectID, {"savedOutputs": updated})
     return jsonify({"message": "Note updated", "noteID": noteID}), 200
 
-@app.route("/assistant/whiteboard/removeNote/<noteID>", methods=["DELETE"])
+@api.route("/assistant/whiteboard/removeNote/<noteID>", methods=["DELETE"])
 @verify_firebase_token
 def remove_note(noteID):
     """
-    Remove note by noteID. Implementation replaces savedOutputs with filtered array (reliable).
+    Remove note by noteID. Deletes the note's doc; notes of unmigrated projects are
+    filtered out of the legacy savedOutputs array.
     Body JSON: { "projectID": "<projectID>" }
     """
     data = request.json or {}
     projectID = data.get("projectID")
     if not projectID:
         return jsonify({"error": "projectID required"}), 400
-    proj_ref = db.collection("projects").document(projectID)
-    proj_doc = proj_ref.get()
-    if not proj_doc.exists:
+    if project_store.delete_note(projectID, noteID):
+        return jsonify({"message": f"Note {noteID} removed"}), 200
+
+    proj = project_store.get(projectID, ["savedOutputs"])
+    if proj is None:
         return jsonify({"error": "Project not found"}), 404
-    saved = proj_doc.to_dict().get("savedOutputs", [])
+    saved = proj.get("savedOutputs", [])
     new_saved = [item for item in saved if not (isinstance(item, dict) and item.get("noteID") == noteID)]
-    proj_ref.update({"savedOutputs": new_saved})
+    if len(new_saved) != len(saved):
+        project_store.update(projectID, {"savedOutputs": new_saved})
     return jsonify({"message": f"Note {noteID} removed"}), 200
 
+# ------------------- App Factory -------------------
+def create_app():
+    """Build the Flask app. Cheap: datastore and Gemini clients are created on first use."""
+    app = Flask(__name__)
+    CORS(app)  # dev: allow all; tighten in production
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    app.json = json_provider(app)
+    app.register_blueprint(api)
+    return app
+
+
+def warm_up():
+    """Create the configured clients ahead of the first request (e.g. right after a worker boots)."""
+    if DATA_BACKEND == "firestore":
+        get_db()
+    if AUTH_BACKEND != "local":
+        firebase_auth()
+    if LLM_BACKEND != "stub":
+        get_model(DEFAULT_MODEL)
+        _retryable_llm_errors()
+
+
+app = create_app()  # for `gunicorn app:app` and `flask --app app`
+
 # ------------------- Run -------------------
 if __name__ == "__main__":
-    # debug True for development; set False in production
+    # development server only; in production run `gunicorn -c gunicorn.conf.py` (see that file)
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,721 @@
+# bench.py  -- LaunchPad AI backend benchmarks (no network, no credentials)
+#
+# Runs app.py in-process against the memory datastore, the stub LLM and locally minted
+# auth tokens, with injectable latency for both backends.
+#
+#   python bench.py routes [--concurrency 8] [--requests 200] [--llm-latency-ms 50]
+#                          [--db-latency-ms 2] [--only branding,ideation] [--llm-cache]
+#                          [--out results.json] [--compare baseline.json]
+#   python bench.py micro [--only auth,model-handles] [--iterations 5000]
+#   python bench.py http --url http://127.0.0.1:5000 [--concurrency 64] [--requests 640]
+#   python bench.py startup [--runs 5] [--target-ms 400]
+#
+# `routes` drives every endpoint, printing p50/p95/p99 latency, throughput and per-request
+# allocation (tracemalloc peak KiB and blocks still allocated afterwards) per route; --out saves JSON, --compare diffs against a
+# previous run. `micro` runs focused microbenchmarks of individual hot-path helpers.
+# `http` runs the same scenarios over real HTTP against a server started with the offline
+# backends and LOCAL_AUTH_SECRET=bench-secret (e.g. `gunicorn -c gunicorn.conf.py`); all
+# requests come from one user, so also raise ADMISSION_MAX_PER_USER above --concurrency.
+# `startup` times cold `import app` in fresh interpreters and lists the heaviest imports.
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def load_app(llm_latency_ms=0, db_latency_ms=0):
+    """Import app.py wired to the offline backends. Must run before anything else imports app."""
+    os.environ.update({
+        "DATA_BACKEND": "memory",
+        "LLM_BACKEND": "stub",
+        "AUTH_BACKEND": "local",
+        "LOCAL_AUTH_SECRET": "bench-secret",
+        "STUB_LLM_LATENCY_MS": str(llm_latency_ms),
+        "STUB_DB_LATENCY_MS": str(db_latency_ms),
+    })
+    os.environ.setdefault("ADMISSION_MAX_PER_USER", "1000")  # every scenario runs as the same user
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    warnings.filterwarnings("ignore")
+    import app
+    return app
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+# ------------------- Route Scenarios -------------------
+class Fixture:
+    """A signed-up user with a pool of seeded projects and notes to act on."""
+
+    def __init__(self, app, pool_size, client_factory=None):
+        self.app = app
+        self.new_client = client_factory or app.app.test_client
+        client = self.new_client()
+        r = client.post("/user/signup", json={"email": "bench@example.com", "password": "bench", "name": "Bench"})
+        self.uid = r.get_json()["userID"]
+        self.headers = {"Authorization": f"Bearer {app.mint_local_token(self.uid, ttl=24 * 3600)}"}
+        self.projects = [self._create_project(client, i) for i in range(pool_size)]
+        self.notes = []
+        for pid in self.projects:
+            r = client.post("/assistant/whiteboard/addNote", json={"projectID": pid, "text": "seed"}, headers=self.headers)
+            self.notes.append((pid, r.get_json()["note"]["noteID"]))
+        r = client.post("/assistant/legal/simplifyDocument",
+                        json={"projectID": self.projects[0], "text": "seed", "async": True}, headers=self.headers)
+        self.job_id = r.get_json()["jobID"]
+        self._lock = threading.Lock()
+        self._i = 0
+
+    def _create_project(self, client, i):
+        r = client.post("/project/create", json={"projectName": f"Bench project {i}"}, headers=self.headers)
+        pid = r.get_json()["projectID"]
+        client.post("/assistant/motivation/achievement",
+                    json={"projectID": pid, "achievementText": "Shipped the MVP"}, headers=self.headers)
+        return pid
+
+    def next_index(self):
+        with self._lock:
+            self._i += 1
+            return self._i
+
+    def project(self):
+        return self.projects[self.next_index() % len(self.projects)]
+
+    def note(self):
+        return self.notes[self.next_index() % len(self.notes)]
+
+
+IDEA = "A marketplace that matches freelance accountants with early-stage startups, priced per month."
+ROADMAP_IDEAS = [{"name": "LedgerMatch", "description": IDEA}]
+
+
+def _add_note_then(method, path_fmt):
+    """Scenario for routes that consume a note: each request gets its own fresh note."""
+    def build(fx, client):
+        pid = fx.project()
+        r = client.post("/assistant/whiteboard/addNote", json={"projectID": pid, "text": "n"}, headers=fx.headers)
+        return method, path_fmt.format(noteID=r.get_json()["note"]["noteID"]), {"projectID": pid, "text": "edited"}
+    return build
+
+
+def _create_then_delete(fx, client):
+    r = client.post("/project/create", json={"projectName": "to delete"}, headers=fx.headers)
+    return "DELETE", f"/project/{r.get_json()['projectID']}/delete", None
+
+
+# name -> (group, builder(fx, client) -> (method, path, json body)). Builders may do untimed setup.
+ROUTES = {
+    "signup": ("user", lambda fx, c: ("POST", "/user/signup", {"email": f"u{fx.next_index()}@example.com", "password": "pw"})),
+    "get_user": ("user", lambda fx, c: ("GET", f"/user/{fx.uid}", None)),
+    "create_project": ("project", lambda fx, c: ("POST", "/project/create", {"projectName": "bench"})),
+    "get_project": ("project", lambda fx, c: ("GET", f"/project/{fx.project()}", None)),
+    "update_project": ("project", lambda fx, c: ("PUT", f"/project/{fx.project()}/update", {"status": "active"})),
+    "delete_project": ("project", _create_then_delete),
+    "get_job": ("project", lambda fx, c: ("GET", f"/jobs/{fx.job_id}", None)),
+    "dashboard_view_projects": ("dashboard", lambda fx, c: ("GET", "/dashboard/viewProjects", None)),
+    "dashboard_track_progress": ("dashboard", lambda fx, c: ("GET", f"/dashboard/{fx.project()}/trackProgress", None)),
+    "branding_generate_name": ("branding", lambda fx, c: ("POST", "/assistant/branding/generateName", {"projectID": fx.project(), "idea": IDEA})),
+    "branding_tagline": ("branding", lambda fx, c: ("POST", "/assistant/branding/createTagline", {"projectID": fx.project(), "idea": IDEA})),
+    "branding_content": ("branding", lambda fx, c: ("POST", "/assistant/branding/generateContent", {"projectID": fx.project(), "idea": IDEA})),
+    "branding_suggest_colors": ("branding", lambda fx, c: ("POST", "/assistant/branding/suggestColors", {"projectID": fx.project(), "idea": IDEA})),
+    "branding_batch": ("branding", lambda fx, c: ("POST", "/assistant/branding/batch", {"projectID": fx.project(), "idea": IDEA, "save": True})),
+    "legal_simplify": ("legal", lambda fx, c: ("POST", "/assistant/legal/simplifyDocument", {"projectID": fx.project(), "text": "The party of the first part..."})),
+    "legal_structure": ("legal", lambda fx, c: ("POST", "/assistant/legal/suggestStructure", {"projectID": fx.project(), "idea": IDEA})),
+    "motivation_encouragement": ("motivation", lambda fx, c: ("GET", "/assistant/motivation/showEncouragement", None)),
+    "motivation_track_milestone": ("motivation", lambda fx, c: ("POST", "/assistant/motivation/trackMilestone", {"projectID": fx.project(), "milestoneName": "Beta"})),
+    "motivation_achievement": ("motivation", lambda fx, c: ("POST", "/assistant/motivation/achievement", {"projectID": fx.project(), "achievementText": "First customer", "celebrate": True})),
+    "motivation_success_stories": ("motivation", lambda fx, c: ("GET", "/assistant/motivation/successStories", None)),
+    "motivation_success_stories_project": ("motivation", lambda fx, c: ("GET", f"/assistant/motivation/successStories?projectID={fx.project()}", None)),
+    "ideation_generate": ("ideation", lambda fx, c: ("POST", "/assistant/ideation/generateIdea", {"projectID": fx.project(), "Name": "LedgerMatch", "Feature": ["matching", "billing"], "save": True})),
+    "ideation_validate": ("ideation", lambda fx, c: ("POST", "/assistant/ideation/validateIdea", {"projectID": fx.project(), "idea": {"name": "LedgerMatch", "description": IDEA}, "save": True})),
+    "ideation_validate_sectioned": ("ideation", lambda fx, c: ("POST", "/assistant/ideation/validateIdea", {"projectID": fx.project(), "idea": {"name": "LedgerMatch", "description": IDEA}, "sectioned": True, "save": True})),
+    "ideation_generate_roadmap": ("ideation", lambda fx, c: ("POST", "/assistant/ideation/generateRoadmap", {"projectID": fx.project(), "ideas": ROADMAP_IDEAS, "params": {"timeline": "6 months"}, "save": True})),
+    "add_note": ("whiteboard", lambda fx, c: ("POST", "/assistant/whiteboard/addNote", {"projectID": fx.project(), "text": "idea"})),
+    "edit_note": ("whiteboard", _add_note_then("PUT", "/assistant/whiteboard/editNote/{noteID}")),
+    "remove_note": ("whiteboard", _add_note_then("DELETE", "/assistant/whiteboard/removeNote/{noteID}")),
+}
+
+
+def _send(client, fx, method, path, body, extra_headers):
+    headers = dict(fx.headers, **extra_headers)
+    return client.open(path, method=method, json=body, headers=headers)
+
+
+def run_route(fx, name, requests, concurrency, extra_headers):
+    build = ROUTES[name][1]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(_):
+        nonlocal errors
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = fx.new_client()
+        method, path, body = build(fx, client)
+        start = time.perf_counter()
+        resp = _send(client, fx, method, path, body, extra_headers)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed * 1000.0)
+            if resp.status_code >= 400:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - wall_start
+    return {
+        "group": ROUTES[name][0],
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "rps": round(len(latencies) / wall, 1),
+    }
+
+
+def _traced_blocks():
+    """Memory blocks tracemalloc currently tracks, leaving out its own bookkeeping."""
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return sum(stat.count for stat in snapshot.statistics("filename"))
+
+
+def measure_allocations(fx, name, samples, extra_headers):
+    """
+    Average tracemalloc peak (KiB) of one request and the number of blocks it left
+    allocated (responses cached, objects retained), measured single-threaded.
+    """
+    client = fx.app.app.test_client()
+    peaks, blocks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            method, path, body = ROUTES[name][1](fx, client)
+            before = _traced_blocks()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            _send(client, fx, method, path, body, extra_headers)
+            peaks.append((tracemalloc.get_traced_memory()[1] - base) / 1024.0)
+            blocks.append(_traced_blocks() - before)
+    finally:
+        tracemalloc.stop()
+    return round(statistics.fmean(peaks), 1), round(statistics.fmean(blocks))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def print_routes(results, baseline=None):
+    header = f"{'route':38} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'allocKiB':>9} {'blocks':>7} {'err':>4}"
+    if baseline:
+        header += f" {'p50 Δ':>8} {'p95 Δ':>8}"
+    print(header)
+    for name, r in results.items():
+        line = (f"{name:38} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+                f"{r['rps']:8.1f} {r.get('alloc_peak_kib', 0):9.1f} {r.get('alloc_blocks', 0):7d} {r['errors']:4d}")
+        old = (baseline or {}).get(name)
+        if old:
+            def delta(key):
+                return f"{(r[key] - old[key]) / old[key] * 100:+7.1f}%" if old[key] else "     n/a"
+            line += f" {delta('p50_ms')} {delta('p95_ms')}"
+        print(line)
+
+
+def cmd_routes(args):
+    app = load_app(args.llm_latency_ms, args.db_latency_ms)
+    fx = Fixture(app, args.pool_size)
+    # Without --llm-cache every request bypasses the response cache, so the stub latency is paid.
+    extra_headers = {} if args.llm_cache else {"Cache-Control": "no-cache"}
+    groups = set(args.only.split(",")) if args.only else None
+    results = {}
+    for name, (group, _) in ROUTES.items():
+        if groups and group not in groups and name not in groups:
+            continue
+        results[name] = run_route(fx, name, args.requests, args.concurrency, extra_headers)
+        results[name]["alloc_peak_kib"], results[name]["alloc_blocks"] = measure_allocations(
+            fx, name, args.alloc_samples, extra_headers)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)["routes"]
+    print_routes(results, baseline)
+
+    if args.out:
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "createdAt": datetime.utcnow().isoformat(),
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "llmLatencyMs": args.llm_latency_ms,
+                "dbLatencyMs": args.db_latency_ms,
+                "llmCache": args.llm_cache,
+            },
+            "routes": results,
+        }
+        with open(args.out, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"saved {args.out}")
+
+
+# ------------------- HTTP Mode -------------------
+class _HTTPResponse:
+    def __init__(self, status, body):
+        self.status_code = status
+        self.data = body
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+class HTTPClient:
+    """The subset of Flask's test client the scenarios use, over one keep-alive connection."""
+
+    def __init__(self, base_url):
+        url = urllib.parse.urlsplit(base_url)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=300)
+
+    def open(self, path, method="GET", json=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json is not None:
+            body = _dumps(json)
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                return _HTTPResponse(resp.status, resp.read())
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed the kept-alive connection; reconnect once
+                self.conn.close()
+                if attempt:
+                    raise
+
+    def get(self, path, **kwargs):
+        return self.open(path, "GET", **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, "POST", **kwargs)
+
+
+_dumps = json.dumps
+
+
+def cmd_http(args):
+    app = load_app()  # only used to mint tokens; the server must share LOCAL_AUTH_SECRET
+    fx = Fixture(app, args.pool_size, lambda: HTTPClient(args.url))
+    extra_headers = {} if args.llm_cache else {"Cache-Control": "no-cache"}
+    groups = set(args.only.split(",")) if args.only else None
+    results = {}
+    for name, (group, _) in ROUTES.items():
+        if groups and group not in groups and name not in groups:
+            continue
+        results[name] = run_route(fx, name, args.requests, args.concurrency, extra_headers)
+    print_routes(results)
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump({"meta": {"commit": git_commit(), "url": args.url, "concurrency": args.concurrency,
+                                "requests": args.requests, "createdAt": datetime.utcnow().isoformat()},
+                       "routes": results}, fh, indent=2)
+        print(f"saved {args.out}")
+
+
+# ------------------- Startup -------------------
+STARTUP_ENVS = {
+    # production backends without credentials: importing must not touch them
+    "production": {"DATA_BACKEND": "firestore", "LLM_BACKEND": "gemini", "AUTH_BACKEND": "firebase"},
+    "offline": {"DATA_BACKEND": "memory", "LLM_BACKEND": "stub", "AUTH_BACKEND": "local", "LOCAL_AUTH_SECRET": "x"},
+}
+
+
+def _cold_import(env, importtime=False):
+    """Run `import app` in a fresh interpreter; returns (seconds, stderr)."""
+    cmd = [sys.executable, "-W", "ignore"] + (["-X", "importtime"] if importtime else []) + ["-c", "import app"]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=dict(os.environ, **env), cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise SystemExit(f"import app failed:\n{proc.stderr[-2000:]}")
+    return elapsed, proc.stderr
+
+
+def _top_imports(importtime_log, n):
+    """Top-level packages by cumulative import time (µs) from a -X importtime log."""
+    totals = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # " app" is the root; its direct imports are indented by two more spaces
+        if name.startswith("   ") and not name.startswith("    "):
+            totals[name.strip()] = int(cumulative)
+    return sorted(totals.items(), key=lambda kv: -kv[1])[:n]
+
+
+def cmd_startup(args):
+    failed = False
+    for name, env in STARTUP_ENVS.items():
+        times = sorted(_cold_import(env)[0] * 1000 for _ in range(args.runs))
+        median = statistics.median(times)
+        verdict = "ok" if median <= args.target_ms else "OVER TARGET"
+        failed |= median > args.target_ms
+        print(f"{name:12} cold import median {median:7.1f} ms  (min {times[0]:.1f}, max {times[-1]:.1f})  "
+              f"target {args.target_ms:.0f} ms: {verdict}")
+    _, log = _cold_import(STARTUP_ENVS["offline"], importtime=True)
+    print("heaviest imports (offline backends, cumulative ms):")
+    for module, micros in _top_imports(log, args.top):
+        print(f"  {module:40} {micros / 1000:8.1f}")
+    if failed:
+        sys.exit(1)
+
+
+# ------------------- Microbenchmarks -------------------
+def _timeit(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6  # µs per call
+
+
+def micro_model_handles(app, iterations):
+    """Per-call model-handle overhead: a new genai.GenerativeModel per call vs the shared registry."""
+    import google.generativeai as genai
+
+    name = "gemini-2.0-flash-lite"
+    return {
+        "new_handle_us": _timeit(lambda: genai.GenerativeModel(name), iterations),
+        "registry_us": _timeit(lambda: app.get_model(name), iterations),
+    }
+
+
+def micro_auth(app, iterations):
+    """verify_firebase_token overhead per request with a locally minted token, cold vs cached."""
+    view = app.verify_firebase_token(lambda: "ok")
+    token = app.mint_local_token("bench-user")
+    ctx = app.app.test_request_context("/", headers={"Authorization": f"Bearer {token}"})
+    ctx.push()
+    try:
+        def cached():
+            view()
+            app._release_admission(None)  # normally done when the request context is torn down
+
+        def cold():
+            app.token_cache._entries.clear()
+            cached()
+        return {"uncached_us": _timeit(cold, iterations), "cached_us": _timeit(cached, iterations)}
+    finally:
+        ctx.pop()
+
+
+def micro_output_writes(app, iterations):
+    """Datastore commits per assistant output: one atomic write per output vs the write-behind buffer."""
+    projectID = app.project_store.create({"projectName": "bench", "lastOutputs": {}})
+    iterations = min(iterations, 1000)
+
+    def run():
+        before = app.metrics.counter("lpai_output_commits_total")
+        for i in range(iterations):
+            app._update_project_output(projectID, "branding", f"output {i}", save=True)
+        if app.output_buffer:
+            app.output_buffer.flush_all()
+        return (app.metrics.counter("lpai_output_commits_total") - before) / iterations
+
+    direct = run()
+    app.output_buffer = app.OutputWriteBuffer(0.05)
+    try:
+        buffered = run()
+    finally:
+        app.output_buffer = None
+    # before this change every output cost exists() + update() + add(): 3 round trips
+    return {"legacy_round_trips": 3, "direct_commits_per_output": direct, "write_behind_commits_per_output": buffered}
+
+
+def micro_pregen(app, iterations):
+    """showEncouragement content: a live (uncached) Gemini call vs a pre-generated pool lookup."""
+    pool = app.VariantPool("bench", app.ENCOURAGEMENT_PROMPT, "motivation", "motivation_encouragement")
+    iterations_live = max(1, min(iterations, 50))
+    live = _timeit(lambda: app.call_gemini(pool.prompt_text, category="motivation", use_cache=False, route=pool.route),
+                   iterations_live)
+    pool.refresh()
+    users = [f"user-{i}" for i in range(100)]
+    counter = iter(range(10 ** 9))
+    return {"live_us": live, "pooled_us": _timeit(lambda: pool.get(users[next(counter) % 100]), iterations)}
+
+
+def _idea_corpus(n, seed=7):
+    """Synthetic ideas (name, features, context) plus lightly edited variants of each."""
+    import random
+
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(600)]
+
+    def phrase(lo, hi):
+        return " ".join(rng.choice(vocab) for _ in range(rng.randint(lo, hi)))
+
+    bases = [{"Name": phrase(1, 2), "Feature": [phrase(4, 8) for _ in range(4)], "Context": [phrase(12, 20)]}
+             for _ in range(n)]
+    variants = []
+    for i, base in enumerate(bases):
+        reordered = dict(base, Feature=list(reversed(base["Feature"])))
+        added = dict(base, Feature=base["Feature"] + [phrase(3, 5)])
+        words = base["Context"][0].split()
+        words[rng.randrange(len(words))] = rng.choice(vocab)
+        reworded = dict(base, Context=[" ".join(words)])
+        variants += [(i, reordered), (i, added), (i, reworded)]
+    return bases, variants
+
+
+def micro_idea_dedup(app, iterations):
+    """Near-duplicate idea lookup: recall on edited variants, false positives on unrelated ideas, latency."""
+    fields = ("Name", "Feature", "Context", "Target Audience")
+    bases, variants = _idea_corpus(300)
+    unrelated, _ = _idea_corpus(300, seed=8)
+    text = lambda idea: app._idea_input_text(idea, fields)
+    index = app.NearDuplicateIndex(app.IDEA_DEDUP_THRESHOLD, max_per_scope=10 ** 6, max_scopes=10)
+    start = time.perf_counter()
+    for i, base in enumerate(bases):
+        index.add("bench", "ideation", text(base), i)
+    add_us = (time.perf_counter() - start) / len(bases) * 1e6
+
+    start = time.perf_counter()
+    hits = sum(1 for i, v in variants if (m := index.find("bench", "ideation", text(v))) and m[1]["result"] == i)
+    query_us = (time.perf_counter() - start) / len(variants) * 1e6
+    false_positives = sum(1 for idea in unrelated if index.find("bench", "ideation", text(idea)))
+
+    # what the index saves over comparing against every stored idea
+    stored = [app.idea_shingles(text(b)) for b in bases]
+    probe = app.idea_shingles(text(variants[0][1]))
+    brute_us = _timeit(lambda: max(app.jaccard(probe, s) for s in stored), 20)
+    return {
+        "ideas": len(bases),
+        "recall": hits / len(variants),
+        "false_positive_rate": false_positives / len(unrelated),
+        "add_us": add_us,
+        "lsh_query_us": query_us,
+        "brute_force_query_us": brute_us,
+    }
+
+
+def micro_project_cache(app, iterations):
+    """Project doc reads with 2 ms datastore latency: every read from the store vs the read-through cache."""
+    import random
+
+    iterations = min(iterations, 1000)
+    saved_latency, app.STUB_DB_LATENCY_MS = app.STUB_DB_LATENCY_MS, 2
+    try:
+        inner = app.MemoryProjectStore()
+        cached = app.CachedProjectStore(inner, max_entries=100, max_bytes=64 << 20, max_age=30)
+        ids = [inner.create({"projectName": f"p{i}", "lastOutputs": {"branding": "x" * 2000}}) for i in range(400)]
+
+        def workload(store):
+            # skewed towards a few hot projects; every 10th operation writes an output
+            rng = random.Random(3)
+            start = time.perf_counter()
+            for i in range(iterations):
+                pid = ids[min(int(rng.paretovariate(1.2)) - 1, len(ids) - 1)]
+                if i % 10 == 9:
+                    store.record_outputs(pid, {"legal": f"v{i}"}, [])
+                else:
+                    store.get(pid, ["timeline", "milestones", "achievements", "lastOutputs"])
+            return (time.perf_counter() - start) / iterations * 1e6
+
+        uncached_us = workload(inner)
+        cached_us = workload(cached)
+    finally:
+        app.STUB_DB_LATENCY_MS = saved_latency
+    stats = cached.stats()
+    return {"uncached_us": uncached_us, "cached_us": cached_us, "hit_ratio": stats["hitRatio"],
+            "entries": stats["entries"], "evictions": stats["evictions"]}
+
+
+def _large_project(saved=60, seed=11):
+    """A project doc the size of a long-lived one: every assistant output plus its saved history."""
+    import random
+
+    rng = random.Random(seed)
+    letters = "etaoinshrdlucmfwypvbgk"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(3000)]
+    text = lambda n: " ".join(rng.choice(words) for _ in range(n))
+    roadmap = {"phases": [{"name": f"Phase {i}", "goals": [text(12) for _ in range(4)],
+                           "tasks": [{"title": text(6), "owner": "founder", "weeks": rng.randint(1, 6)} for _ in range(8)]}
+                          for i in range(5)]}
+    outputs = {
+        "ideation": {"ideas": text(900), "timestamp": datetime.utcnow().isoformat()},
+        "ideation_validation": {"validationReport": text(1500), "scores": {"overallRisk": 4}, "ideaName": "LedgerMatch"},
+        "ideation_roadmap": {"roadmap": roadmap, "type": "roadmap"},
+        "branding": {"names": text(200), "tagline": text(40), "content": text(600)},
+        "legal": {"simplified": text(800)},
+    }
+    history = [dict(rng.choice(list(outputs.values())), category="ideation", savedAt=datetime.utcnow().isoformat())
+               for _ in range(saved)]
+    return {"projectID": "bench", "projectName": "LedgerMatch", "status": "active", "timeline": "6 months",
+            "lastOutputs": outputs, "savedOutputs": history}
+
+
+def micro_serialization(app, iterations):
+    """GET /project body for a large project: stdlib vs orjson encode time, and bytes on the wire per encoding."""
+    from flask.json.provider import DefaultJSONProvider
+
+    doc = _large_project()
+    iterations = min(iterations, 500)
+    results = {"stdlib_us": _timeit(lambda: DefaultJSONProvider(app.app).response(doc), iterations)}
+    try:
+        import orjson
+        results["orjson_us"] = _timeit(lambda: app.OrjsonProvider(app.app, orjson).response(doc), iterations)
+    except ImportError:
+        results["orjson_us"] = "n/a (pip install orjson)"
+    body = DefaultJSONProvider(app.app).response(doc).get_data()
+    results["identity_bytes"] = len(body)
+    for encoding in ("gzip", "br"):
+        if encoding == "br" and not app._brotli_module():
+            results["br_bytes"] = "n/a (pip install brotli)"
+            continue
+        results[f"{encoding}_bytes"] = len(app.compress_body(body, encoding))
+        results[f"{encoding}_us"] = _timeit(lambda: app.compress_body(body, encoding), min(iterations, 100))
+    return results
+
+
+def micro_bulk_export(app, iterations):
+    """Export/import throughput for thousands of projects at 2 ms datastore latency, vs a get_project per ID."""
+    n = min(iterations, 5000)
+    client = app.app.test_client()
+    uid = client.post("/user/signup", json={"email": "bulk@example.com", "password": "bench", "name": "Bulk"}).get_json()["userID"]
+    headers = {"Authorization": f"Bearer {app.mint_local_token(uid)}"}
+    doc = _large_project(saved=4)
+    doc["lastOutputs"] = {"legal": doc["lastOutputs"]["legal"], "branding": doc["lastOutputs"]["branding"]}
+    seed = app._import_project(doc)
+    for i in range(0, n, 100):
+        app.user_store.add_projects(uid, app.bulk_project_store.import_projects([seed] * min(100, n - i)))
+
+    saved_latency, app.STUB_DB_LATENCY_MS = app.STUB_DB_LATENCY_MS, 2
+    try:
+        ids = app.user_store.get(uid)["projects"]
+        sample = ids[:200]
+        start = time.perf_counter()
+        for pid in sample:
+            client.get(f"/project/{pid}", headers=headers, environ_base={"HTTP_CACHE_CONTROL": "no-cache"})
+        per_id_s = (time.perf_counter() - start) / len(sample)
+
+        with tempfile.TemporaryFile() as out:  # keeps the export itself out of the traced memory
+            tracemalloc.start()
+            start = time.perf_counter()
+            resp = client.get(f"/user/{uid}/export", headers=headers, buffered=False)
+            for chunk in resp.response:
+                out.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            export_s = time.perf_counter() - start
+            _, export_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            out.seek(0)
+            body = out.read()
+
+        start = time.perf_counter()
+        r = client.post(f"/user/{uid}/import", data=body, headers=dict(headers, **{"Content-Type": "application/x-ndjson"}))
+        import_s = time.perf_counter() - start
+        assert r.status_code == 201, r.get_json()
+    finally:
+        app.STUB_DB_LATENCY_MS = saved_latency
+    return {
+        "projects": n,
+        "get_project_per_id_rps": 1 / per_id_s,
+        "export_projects_per_s": n / export_s,
+        "export_mib_per_s": len(body) / export_s / 2 ** 20,
+        "export_peak_kib": export_peak / 1024,
+        "export_mib": len(body) / 2 ** 20,
+        "import_projects_per_s": n / import_s,
+    }
+
+
+MICRO = {
+    "model-handles": micro_model_handles,
+    "auth": micro_auth,
+    "output-writes": micro_output_writes,
+    "pregen": micro_pregen,
+    "idea-dedup": micro_idea_dedup,
+    "project-cache": micro_project_cache,
+    "serialization": micro_serialization,
+    "bulk-export": micro_bulk_export,
+}
+
+
+def cmd_micro(args):
+    app = load_app()
+    for name, fn in MICRO.items():
+        if args.only and name not in args.only.split(","):
+            continue
+        results = fn(app, args.iterations)
+        print(f"{name:16} " + "  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in results.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LaunchPad AI backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    routes = sub.add_parser("routes", help="latency percentiles per route")
+    routes.add_argument("--concurrency", type=int, default=8)
+    routes.add_argument("--requests", type=int, default=200, help="requests per route")
+    routes.add_argument("--llm-latency-ms", type=float, default=50)
+    routes.add_argument("--db-latency-ms", type=float, default=2)
+    routes.add_argument("--pool-size", type=int, default=20, help="seeded projects to spread requests over")
+    routes.add_argument("--alloc-samples", type=int, default=5)
+    routes.add_argument("--only", help="comma-separated route names or groups")
+    routes.add_argument("--llm-cache", action="store_true", help="let requests hit the LLM response cache")
+    routes.add_argument("--out", help="write results JSON here")
+    routes.add_argument("--compare", help="baseline results JSON to diff against")
+    routes.set_defaults(func=cmd_routes)
+
+    micro = sub.add_parser("micro", help="hot-path microbenchmarks")
+    micro.add_argument("--only", help=f"comma-separated subset of: {', '.join(MICRO)}")
+    micro.add_argument("--iterations", type=int, default=5000)
+    micro.set_defaults(func=cmd_micro)
+
+    over_http = sub.add_parser("http", help="route throughput against a running server")
+    over_http.add_argument("--url", default="http://127.0.0.1:5000")
+    over_http.add_argument("--concurrency", type=int, default=64)
+    over_http.add_argument("--requests", type=int, default=640, help="requests per route")
+    over_http.add_argument("--pool-size", type=int, default=20, help="seeded projects to spread requests over")
+    over_http.add_argument("--only", help="comma-separated route names or groups")
+    over_http.add_argument("--llm-cache", action="store_true", help="let requests hit the LLM response cache")
+    over_http.add_argument("--out", help="write results JSON here")
+    over_http.set_defaults(func=cmd_http)
+
+    startup = sub.add_parser("startup", help="cold import time and heaviest imports")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--target-ms", type=float, default=400, help="fail if the median cold import exceeds this")
+    startup.add_argument("--top", type=int, default=10)
+    startup.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
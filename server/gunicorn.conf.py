@@ -0,0 +1,87 @@
+# gunicorn.conf.py  -- production serving for the LaunchPad AI backend
+#
+#   pip install "gunicorn>=23"
+#   cd server && gunicorn -c gunicorn.conf.py
+#
+# Worker model: gthread. Requests spend almost all their time waiting on Gemini and
+# Firestore (network I/O that releases the GIL), so one process with many threads
+# serves far more concurrent requests than sync workers, without gevent's monkey
+# patching (which the grpc-based Firestore/Gemini clients do not support by default).
+#
+# Async jobs, the LLM/token caches and the pre-generated content pools live in process
+# memory, so keep WEB_CONCURRENCY=1 unless /jobs polling is pinned to a worker; scale
+# threads first, then hosts. LLM_RATE_LIMIT_DB shares the Gemini rate limit between
+# processes on one host.
+#
+# Graceful shutdown: on SIGTERM a worker stops accepting connections, finishes its
+# in-flight requests, then app.drain() waits for queued/running async jobs and pool
+# refreshes (new jobs get 503) and flushes buffered output writes. Everything must finish
+# within GUNICORN_GRACEFUL_TIMEOUT, which defaults to LLM_DEADLINE_SECONDS + 30 so a
+# request that started just before SIGTERM can still complete its Gemini call.
+#
+# Throughput against the offline backends (DATA_BACKEND=memory LLM_BACKEND=stub
+# AUTH_BACKEND=local LOCAL_AUTH_SECRET=bench-secret STUB_LLM_LATENCY_MS=200
+# STUB_DB_LATENCY_MS=2 PREGEN_VARIANTS=0, then `python bench.py http --concurrency 64
+# --requests 640`; uncached, 1 vCPU, client on the same host):
+#
+#   route                      `python app.py`   gthread 1x32   gthread 1x64 (default)
+#   get_project                    367 rps          451 rps          588 rps
+#   dashboard_view_projects        263 rps          387 rps          431 rps
+#   legal_simplify                 251 rps          151 rps          263 rps
+#   ideation_validate              220 rps          146 rps          278 rps
+#   branding_batch                 243 rps          140 rps          235 rps
+#
+# LLM-bound routes top out at threads / Gemini latency, so size GUNICORN_THREADS to the
+# expected concurrency. branding_batch makes 4 calls per request on its own pool, sized
+# so every admitted request (plus every async job) runs them at once, which keeps it on
+# par with the single-call routes; it used to be capped at 20 rps by a fixed 16 threads.
+# The dev server is not far behind on the LLM routes because it also spawns a thread per
+# request, but it runs the reloader/debugger and has no keep-alive or graceful shutdown.
+#
+# These numbers predate admission control (app.py). It now caps the LLM routes at
+# ADMISSION_LLM_LIMIT running + ADMISSION_LLM_QUEUE waiting requests (32 + 16 by default),
+# so at least 16 of the 64 threads stay free for CRUD routes when Gemini slows down. Raise
+# them together with GUNICORN_THREADS, keeping that headroom. To reproduce the table,
+# start the server with ADMISSION_LLM_LIMIT=0 ADMISSION_DB_LIMIT=0.
+
+import multiprocessing
+import os
+import signal
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", str(max(64, 32 * multiprocessing.cpu_count()))))
+# gthread workers heartbeat from the main thread, so long Gemini calls do not trip this
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", str(int(float(os.getenv("LLM_DEADLINE_SECONDS", "60"))) + 30)))
+keepalive = 5
+# recycle workers now and then to bound memory growth of the in-process caches
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    """Warm the lazily created clients off the request path; drain as soon as the worker is told to stop."""
+    import threading
+
+    import app
+
+    threading.Thread(target=app.warm_up, name="warm-up", daemon=True).start()
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        app.begin_drain(max(1, graceful_timeout - 5))
+        stop(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def worker_exit(server, worker):
+    import app
+
+    idle = app.drain(max(1, graceful_timeout - 5))
+    server.log.info("worker %s drained (%s)", worker.pid, "clean" if idle else "timed out")